@@ -12,26 +12,1330 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from collections import Counter, OrderedDict
 from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlsplit
+import argparse
+import cProfile
+import hashlib
+import io
+import itertools
 import json
+import logging
+import multiprocessing
 import os
 import base64
+import pstats
+import gzip
+import random
+import signal
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+import zlib
+
+# Seconds an idle keep-alive connection is kept open before it is closed.
+KEEPALIVE_TIMEOUT_SECONDS = 60
+
+logger = logging.getLogger("kubeflow-pipelines-profile-controller")
+
+# Request bodies are read from the socket in chunks of at most this size.
+READ_CHUNK_BYTES = 64 * 1024
+
+# Namespaces whose resync period and cached responses are remembered, least
+# recently synced namespaces start over once there are more.
+MAX_TRACKED_NAMESPACES = 16384
+
+# Seconds the supervisor waits before restarting a worker process that died.
+WORKER_RESTART_DELAY_SECONDS = 1
+
+# Histogram buckets for durations in seconds and payload sizes in bytes.
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                    0.25, 0.5, 1.0, 2.5)
+SIZE_BUCKETS = tuple(256 * 4 ** i for i in range(8))
+
+# Stands in for the parent namespace in the precompiled child templates.
+NAMESPACE_PLACEHOLDER = "$(PROFILE_NAMESPACE)"
+
+# Namespace annotations choosing how the optional per-namespace components
+# are provisioned, and the name shared by each component's child objects.
+OPTIONAL_COMPONENTS = {
+    "pipelines.kubeflow.org/visualization-server":
+        "ml-pipeline-visualizationserver",
+    "pipelines.kubeflow.org/artifact-fetcher": "ml-pipeline-ui-artifact",
+}
+
+# "scaled-to-zero" keeps a component's objects but runs no pods for it.
+COMPONENT_MODES = ("enabled", "scaled-to-zero", "disabled")
+
+# Longest window /debug/profile and /debug/tracemalloc may be asked to
+# cover, and the interval at which /debug/profile samples stacks.
+MAX_PROFILE_SECONDS = 300
+PROFILE_SAMPLE_INTERVAL_SECONDS = 0.005
+
+# Settings the desired children are compiled from, which can be reloaded
+# from the settings directory while the controller is running.
+CHILD_SETTINGS = (
+    "visualization_server_image", "visualization_server_tag",
+    "frontend_image", "frontend_tag", "disable_istio_sidecar",
+    "minio_access_key", "minio_secret_key", "minio_service_region",
+    "kfp_default_pipeline_root", "visualization_server_mode",
+    "artifact_fetcher_mode",
+)
 
 
 def main():
-    settings = get_settings_from_env()
-    server = server_factory(**settings)
+    parser = argparse.ArgumentParser(
+        description="Kubeflow Pipelines profile controller")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser(
+        "serve", help="Serve the metacontroller sync webhook (the default)")
+    render_parser = subparsers.add_parser(
+        "render",
+        help="Write the children the controller would create for each "
+             "namespace, then summarize their resource requests on stderr")
+    render_parser.add_argument(
+        "namespaces", nargs="?", type=argparse.FileType("r"),
+        default=sys.stdin,
+        help="File with one namespace name or Namespace JSON object per "
+             "line (default: stdin)")
+    render_parser.add_argument(
+        "--output-format", choices=("yaml", "json"), default="yaml",
+        help="Multi-document YAML stream or one JSON object per line")
+    render_parser.add_argument(
+        "--include-secrets", action="store_true",
+        help="Also write the MinIO credential Secrets")
+    args = parser.parse_args()
+
+    try:
+        # Rendered Secrets are left out unless asked for, so rendering does
+        # not need the MinIO credentials.
+        settings = get_settings_from_env(require_minio_credentials=(
+            args.command != "render" or args.include_secrets))
+    except MissingSettings as e:
+        parser.exit(1, "{}: error: {}\n".format(parser.prog, e))
+    if args.command == "render":
+        # stdout carries the rendered children.
+        configure_logging(settings.pop("log_level"),
+                          settings.pop("log_format"), stream=sys.stderr)
+        compiled_children = compile_children(**dict(
+            (name, settings[name]) for name in CHILD_SETTINGS))
+        render_to_stream(compiled_children, args.namespaces, sys.stdout,
+                         sys.stderr, args.output_format, args.include_secrets)
+        return
+
+    configure_logging(settings.pop("log_level"), settings.pop("log_format"))
+    controller_processes = int(settings.pop("controller_processes"))
+    if controller_processes <= 1:
+        serve_until_terminated(server_factory(**settings))
+    else:
+        supervise_workers(controller_processes, settings)
+
+
+def serve_until_terminated(server):
+    """
+    Serves requests until SIGTERM, then finishes in-flight syncs and returns
+    """
+    def terminate(signum, frame):
+        # shutdown() blocks until serve_forever() returns, so it can not run
+        # on the thread serving requests.
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, terminate)
     server.serve_forever()
+    server.server_close()
+
+
+def supervise_workers(controller_processes, settings):
+    """
+    Forks controller_processes workers sharing the controller port
+
+    Each worker binds its own socket with SO_REUSEPORT so the kernel balances
+    connections between them. Workers that die are restarted until SIGTERM,
+    which is forwarded to every worker so they drain before exiting.
+    """
+    metrics = ControllerMetrics(shared=True)
+    workers = set()
+    terminating = []
+
+    def start_worker():
+        if terminating:
+            return
+        # SIGTERM is held back until the child has dropped the supervisor's
+        # handler and the parent has recorded the child, so terminate never
+        # runs in a worker nor misses one.
+        signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGTERM])
+        try:
+            pid = os.fork()
+            if pid == 0:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.pthread_sigmask(signal.SIG_UNBLOCK, [signal.SIGTERM])
+                exit_code = 0
+                try:
+                    serve_until_terminated(server_factory(
+                        reuse_port=True, metrics=metrics, **settings))
+                except Exception:
+                    logger.exception("Worker failed")
+                    exit_code = 1
+                finally:
+                    logging.shutdown()
+                    os._exit(exit_code)
+            workers.add(pid)
+        finally:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, [signal.SIGTERM])
+
+    def terminate(signum, frame):
+        terminating.append(signum)
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                # The worker exited and has not been reaped yet.
+                pass
+
+    signal.signal(signal.SIGTERM, terminate)
+    for _ in range(controller_processes):
+        start_worker()
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        workers.discard(pid)
+        if not terminating:
+            logger.warning("Restarting worker process", extra={"fields": {
+                "pid": pid,
+                "status": status,
+            }})
+            time.sleep(WORKER_RESTART_DELAY_SECONDS)
+            start_worker()
+
+
+def render_to_stream(compiled_children, namespaces, output, summary,
+                     output_format="yaml", include_secrets=False):
+    """
+    Writes the children of every namespace to output and a summary to summary
+
+    namespaces is an iterable of lines read by read_namespaces. Children are
+    written one document at a time as they are rendered, so memory use does
+    not grow with the number of namespaces.
+    """
+    parents = 0
+    objects = Counter()
+    requests = Counter()
+    for parent in read_namespaces(namespaces):
+        parents += 1
+        for child in render_namespace(compiled_children, parent):
+            if child["kind"] == "Secret" and not include_secrets:
+                continue
+            if output_format == "json":
+                output.write(json.dumps(child, sort_keys=True) + "\n")
+            else:
+                # JSON documents are valid YAML.
+                output.write("---\n" + json.dumps(child, indent=2) + "\n")
+            objects[child["kind"]] += 1
+            requests.update(resource_requests(child))
+    output.flush()
+
+    summary.write("Rendered {} objects for {} namespaces\n".format(
+        sum(objects.values()), parents))
+    for kind, count in sorted(objects.items()):
+        summary.write("  {:<24}{:>8}\n".format(kind, count))
+    summary.write("Total CPU requests: {:g} cores\n".format(requests["cpu"]))
+    summary.write("Total memory requests: {:.1f}Mi\n".format(
+        requests["memory"] / 2 ** 20))
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Formats records as a message followed by the record's key/value fields
+
+    Fields are passed as logger.info(msg, extra={"fields": {...}}) and are
+    rendered as key=value pairs, or as keys of a JSON object for json_format.
+    """
+
+    def __init__(self, json_format=False):
+        logging.Formatter.__init__(self)
+        self.json_format = json_format
+
+    def format(self, record):
+        fields = getattr(record, "fields", {})
+        if self.json_format:
+            entry = {
+                "time": self.formatTime(record),
+                "level": record.levelname,
+                "message": record.getMessage(),
+            }
+            entry.update(fields)
+            return json.dumps(entry)
+        return " ".join(
+            [self.formatTime(record), record.levelname, record.getMessage()] +
+            ["{}={}".format(key, value) for key, value in fields.items()])
+
+
+def configure_logging(log_level, log_format, stream=None):
+    """
+    Sends the controller's logs to stream (stdout) at log_level in log_format
+    """
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(StructuredFormatter(json_format=log_format == "json"))
+    logger.addHandler(handler)
+    logger.setLevel(log_level.upper())
+    logger.propagate = False
+
+
+class ConnectionThreadHTTPServer(HTTPServer):
+    """
+    HTTPServer that handles each connection on a thread of its own
+
+    Idle keep-alive connections only hold their own thread, so they never
+    keep other connections from being served. The handler bounds how many
+    requests are processed at once. Connections accepted while
+    max_connections are open are closed right away.
+    """
+    request_queue_size = 128
+
+    def __init__(self, server_address, RequestHandlerClass,
+                 bind_and_activate=True, max_connections=128):
+        HTTPServer.__init__(self, server_address, RequestHandlerClass,
+                            bind_and_activate)
+        self.max_connections = max_connections
+        # Threads serving each open connection, by connection.
+        self.connections = {}
+        self.connections_lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        thread = threading.Thread(target=self.process_request_thread,
+                                  args=(request, client_address), daemon=True)
+        with self.connections_lock:
+            accepted = len(self.connections) < self.max_connections
+            if accepted:
+                self.connections[request] = thread
+        if not accepted:
+            logger.warning("Refused connection", extra={"fields": {
+                "client": client_address[0],
+                "max_connections": self.max_connections,
+            }})
+            self.shutdown_request(request)
+            return
+        thread.start()
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            with self.connections_lock:
+                self.connections.pop(request, None)
+            self.shutdown_request(request)
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        # Wake up threads waiting on idle keep-alive connections. Syncs in
+        # progress have already read their request and can still respond.
+        with self.connections_lock:
+            threads = list(self.connections.values())
+            for connection in self.connections:
+                try:
+                    connection.shutdown(socket.SHUT_RD)
+                except OSError:
+                    pass
+        for thread in threads:
+            thread.join()
+
+
+class ChildTemplate(object):
+    """
+    A desired child object serialized once, with the namespace spliced in per sync
+    """
+
+    def __init__(self, child):
+        self.child_type = "{}.{}".format(child["kind"], child["apiVersion"])
+        self.fragments = json.dumps(child, sort_keys=True).split(
+            json.dumps(NAMESPACE_PLACEHOLDER))
+
+    def render(self, encoded_namespace):
+        return encoded_namespace.join(self.fragments)
+
+
+def render_children(templates, namespace):
+    """
+    Returns the JSON array of templates rendered into namespace
+    """
+    encoded_namespace = json.dumps(namespace)
+    return "[%s]" % ", ".join(
+        template.render(encoded_namespace) for template in templates)
+
+
+class ResponseCache(object):
+    """
+    LRU cache of serialized sync responses shared by worker threads
+
+    With a size, at most size entries are kept. Without one, the cache keeps
+    the latest entry of each namespace, so it grows with the number of
+    namespaces synced up to MAX_TRACKED_NAMESPACES. A size of 0 disables it.
+    """
+
+    def __init__(self, size=None):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        # Namespace and body, by key.
+        self.entries = OrderedDict()
+        # Key of the latest entry of each namespace, when size is None.
+        self.namespace_keys = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, body, namespace=None):
+        if self.size is not None and self.size <= 0:
+            return
+        with self.lock:
+            if self.size is None:
+                previous_key = self.namespace_keys.get(namespace)
+                if previous_key is not None and previous_key != key:
+                    self.entries.pop(previous_key, None)
+                self.namespace_keys[namespace] = key
+            self.entries[key] = (namespace, body)
+            self.entries.move_to_end(key)
+            max_entries = self.size
+            if max_entries is None:
+                max_entries = MAX_TRACKED_NAMESPACES
+            while len(self.entries) > max_entries:
+                evicted_key, (evicted_namespace, _) = \
+                    self.entries.popitem(last=False)
+                if self.namespace_keys.get(evicted_namespace) == evicted_key:
+                    del self.namespace_keys[evicted_namespace]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.namespace_keys.clear()
+
+
+def metric_values(size, shared):
+    """
+    Returns zeroed storage for size metric values and the lock guarding it
+
+    Shared storage lives in memory inherited by forked worker processes, so
+    every worker serves the totals of all of them.
+    """
+    if shared:
+        values = multiprocessing.Array("d", size)
+        return values, values.get_lock()
+    return [0] * size, threading.Lock()
+
+
+class HistogramMetric(object):
+    """
+    Prometheus histogram with fixed buckets, observed from worker threads
+    """
+
+    def __init__(self, name, documentation, buckets, shared=False):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        # One cumulative count per bucket, followed by the total count and sum.
+        self.values, self.lock = metric_values(len(buckets) + 2, shared)
+
+    def observe(self, value):
+        with self.lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.values[i] += 1
+            self.values[-2] += 1
+            self.values[-1] += value
+
+    def expose(self):
+        with self.lock:
+            values = list(self.values)
+        lines = [
+            "# HELP {} {}".format(self.name, self.documentation),
+            "# TYPE {} histogram".format(self.name),
+        ]
+        for bound, count in zip(self.buckets, values):
+            lines.append('{}_bucket{{le="{}"}} {}'.format(
+                self.name, bound, int(count)))
+        lines += [
+            '{}_bucket{{le="+Inf"}} {}'.format(self.name, int(values[-2])),
+            "{}_sum {}".format(self.name, values[-1]),
+            "{}_count {}".format(self.name, int(values[-2])),
+        ]
+        return lines
+
+
+class CounterMetric(object):
+    """
+    Prometheus counter partitioned by the values of a single label
+    """
+
+    def __init__(self, name, documentation, label, label_values, shared=False):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.label_values = label_values
+        self.values, self.lock = metric_values(len(label_values), shared)
+
+    def inc(self, label_value):
+        with self.lock:
+            self.values[self.label_values.index(label_value)] += 1
+
+    def expose(self):
+        with self.lock:
+            values = list(self.values)
+        lines = [
+            "# HELP {} {}".format(self.name, self.documentation),
+            "# TYPE {} counter".format(self.name),
+        ]
+        for label_value, value in zip(self.label_values, values):
+            lines.append('{}{{{}="{}"}} {}'.format(
+                self.name, self.label, label_value, int(value)))
+        return lines
+
+
+class ControllerMetrics(object):
+    """
+    Metrics served by the controller on /metrics
+    """
+
+    def __init__(self, shared=False):
+        self.sync_duration = HistogramMetric(
+            "kfp_profile_controller_sync_duration_seconds",
+            "Time taken to serve a sync request.", DURATION_BUCKETS, shared)
+        self.request_size = HistogramMetric(
+            "kfp_profile_controller_request_size_bytes",
+            "Size of sync request bodies.", SIZE_BUCKETS, shared)
+        self.response_size = HistogramMetric(
+            "kfp_profile_controller_response_size_bytes",
+            "Size of sync response bodies.", SIZE_BUCKETS, shared)
+        self.json_decode_duration = HistogramMetric(
+            "kfp_profile_controller_json_decode_duration_seconds",
+            "Time taken to parse sync request bodies.", DURATION_BUCKETS,
+            shared)
+        self.json_encode_duration = HistogramMetric(
+            "kfp_profile_controller_json_encode_duration_seconds",
+            "Time taken to render sync responses that were not cached.",
+            DURATION_BUCKETS, shared)
+        self.namespaces_synced = CounterMetric(
+            "kfp_profile_controller_namespaces_synced_total",
+            "Namespaces synced by their kubeflow-pipelines-ready status.",
+            "status", ("ready", "not_ready", "disabled"), shared)
+        self.response_cache_lookups = CounterMetric(
+            "kfp_profile_controller_response_cache_lookups_total",
+            "Sync response cache lookups by result.",
+            "result", ("hit", "miss"), shared)
+        self.parsed_request_lookups = CounterMetric(
+            "kfp_profile_controller_parsed_request_lookups_total",
+            "Lookups of sync request bodies parsed before, by result.",
+            "result", ("hit", "miss"), shared)
+
+    def expose(self):
+        """
+        Returns all metrics in the Prometheus text exposition format
+        """
+        lines = []
+        for metric in (self.sync_duration, self.request_size,
+                       self.response_size, self.json_decode_duration,
+                       self.json_encode_duration, self.namespaces_synced,
+                       self.response_cache_lookups,
+                       self.parsed_request_lookups):
+            lines += metric.expose()
+        return "\n".join(lines) + "\n"
+
+
+class ResyncBackoff(object):
+    """
+    Chooses how long metacontroller should wait before resyncing a namespace
+
+    Namespaces that are not ready are resynced after not_ready_seconds. Ready
+    namespaces start at ready_min_seconds, doubling on every sync up to
+    ready_max_seconds, and start over whenever the parent's generation or
+    the settings fingerprint changes. Periods are kept for the size most
+    recently synced namespaces.
+
+    Periods are only kept in the process serving the sync. With several
+    worker processes, a namespace's syncs land on processes that each back
+    off on their own, and syncs of a namespace served at the same time on
+    different threads each advance its period, so the periods handed out
+    are approximate.
+    """
+
+    def __init__(self, not_ready_seconds, ready_min_seconds, ready_max_seconds,
+                 size=MAX_TRACKED_NAMESPACES):
+        self.not_ready_seconds = not_ready_seconds
+        self.ready_min_seconds = ready_min_seconds
+        self.ready_max_seconds = ready_max_seconds
+        self.size = size
+        self.periods = OrderedDict()
+        self.lock = threading.Lock()
+
+    def next_period(self, namespace, generation, settings_fingerprint, ready):
+        with self.lock:
+            if not ready:
+                self.periods.pop(namespace, None)
+                return self.not_ready_seconds
+            last_version, period = self.periods.get(namespace, (None, None))
+            version = (generation, settings_fingerprint)
+            if period is None or last_version != version:
+                period = self.ready_min_seconds
+            else:
+                period = min(period * 2, self.ready_max_seconds)
+            self.periods[namespace] = (version, period)
+            self.periods.move_to_end(namespace)
+            while len(self.periods) > self.size:
+                self.periods.popitem(last=False)
+            return period
+
+    def forget(self, namespace):
+        with self.lock:
+            self.periods.pop(namespace, None)
+
+
+class MissingSettings(Exception):
+    """
+    Raised when settings the controller needs are not set
+    """
+
+
+class RequestTooLarge(Exception):
+    """
+    Raised when a request body exceeds the controller's max_request_bytes
+    """
+
+
+def read_request_body(rfile, content_length, gzip_encoded, max_bytes):
+    """
+    Reads a request body in bounded chunks, inflating it if gzip_encoded
+
+    Raises RequestTooLarge as soon as either the body on the wire or the
+    inflated body is known to exceed max_bytes, and ValueError if the body
+    is truncated or not valid gzip.
+    """
+    if content_length > max_bytes:
+        raise RequestTooLarge()
+    decompressor = gzip_encoded and zlib.decompressobj(16 + zlib.MAX_WBITS)
+    chunks = []
+    size = 0
+    remaining = content_length
+    while remaining > 0:
+        chunk = rfile.read(min(READ_CHUNK_BYTES, remaining))
+        if not chunk:
+            raise ValueError("request body is truncated")
+        remaining -= len(chunk)
+        if decompressor:
+            chunk = decompressor.decompress(chunk, max_bytes - size + 1)
+            if decompressor.unconsumed_tail:
+                raise RequestTooLarge()
+        size += len(chunk)
+        if size > max_bytes:
+            raise RequestTooLarge()
+        chunks.append(chunk)
+    if decompressor:
+        if not decompressor.eof:
+            raise ValueError("gzip request body is truncated")
+        chunks.append(decompressor.flush())
+    return b"".join(chunks)
+
+
+def accepts_gzip(accept_encoding):
+    """
+    Returns whether an Accept-Encoding header allows a gzip response
+    """
+    for coding in (accept_encoding or "").split(","):
+        name, _, params = coding.partition(";")
+        if name.strip().lower() != "gzip":
+            continue
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
+def with_resync_after(body, seconds):
+    """
+    Adds resyncAfterSeconds to a serialized sync response
+    """
+    return b'%s, "resyncAfterSeconds": %d}' % (body[:-1], seconds)
+
+
+def sample_stacks(seconds, interval, exclude_thread=None):
+    """
+    Returns a Counter of the collapsed stacks of every thread sampled for seconds
+
+    Threads are sampled every interval seconds from sys._current_frames().
+    Stacks are collapsed root first into "file:function" frames joined by
+    semicolons, the input format of flame graph tools.
+    """
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == exclude_thread:
+                continue
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append("{}:{}".format(
+                    os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            stacks[";".join(reversed(frames))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+class ProfileSession(object):
+    """
+    Aggregates cProfile profiles of the requests served while it is active
+
+    cProfile only sees the thread it is enabled on, so each request is
+    profiled on its own worker thread and merged into one set of stats.
+    """
+
+    def __init__(self):
+        self.stats = None
+        self.lock = threading.Lock()
+
+    def run(self, func, *args):
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func, *args)
+        finally:
+            with self.lock:
+                if self.stats is None:
+                    self.stats = pstats.Stats(profile)
+                else:
+                    self.stats.add(profile)
+
+    def report(self, limit):
+        with self.lock:
+            if self.stats is None:
+                return "No requests were profiled\n"
+            stream = io.StringIO()
+            self.stats.stream = stream
+            self.stats.sort_stats("cumulative").print_stats(limit)
+            return stream.getvalue()
+
+
+def top_allocations(seconds, limit):
+    """
+    Returns the limit source lines that allocated the most memory still in use
+
+    If tracemalloc is not already tracing, it traces for seconds first and
+    only allocations made in that window are reported.
+    """
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+        time.sleep(seconds)
+    try:
+        snapshot = tracemalloc.take_snapshot()
+    finally:
+        if started:
+            tracemalloc.stop()
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+    ])
+    statistics = snapshot.statistics("lineno")
+    lines = ["Top {} of {} allocation sites, {} bytes in use".format(
+        min(limit, len(statistics)), len(statistics),
+        sum(stat.size for stat in statistics))]
+    lines += [str(stat) for stat in statistics[:limit]]
+    return "\n".join(lines) + "\n"
+
+
+def child_counts(children):
+    """
+    Returns the number of observed children of each type
+
+    Syncs only depend on these counts, so the observed child objects are not
+    kept once a request is parsed.
+    """
+    return {child_type: len(objects)
+            for child_type, objects in children.items()}
+
+
+def sync_cache_key(settings_fingerprint, parent, children):
+    """
+    Returns a digest of everything the response to a sync depends on
+
+    The desired children only depend on the parent's name, pipelines label
+    and optional component annotations, and the status only on how many
+    children of each type exist.
+    """
+    metadata = parent.get("metadata", {})
+    annotations = metadata.get("annotations", {})
+    inputs = json.dumps([
+        settings_fingerprint,
+        metadata.get("name"),
+        metadata.get("labels", {}).get("pipelines.kubeflow.org/enabled"),
+        [annotations.get(annotation) for annotation in OPTIONAL_COMPONENTS],
+        sorted(children.items()),
+    ])
+    return hashlib.sha256(inputs.encode('utf-8')).digest()
+
+
+def read_namespaces(lines):
+    """
+    Yields a parent Namespace for every non-blank line of lines
+
+    A line is either a namespace name, which is rendered with pipelines
+    enabled, or a Namespace object in JSON, such as a line of
+    kubectl get namespaces -o json | jq -c '.items[]'.
+    """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("{"):
+            yield json.loads(line)
+        else:
+            yield {
+                "apiVersion": "v1",
+                "kind": "Namespace",
+                "metadata": {
+                    "name": line,
+                    "labels": {"pipelines.kubeflow.org/enabled": "true"},
+                },
+            }
+
+
+def render_namespace(compiled_children, parent):
+    """
+    Yields the desired children of parent one at a time
+    """
+    response = json.loads(compiled_children.encode_sync(parent, {}))
+    for child in response["children"]:
+        yield child
+
+
+# Suffixes of Kubernetes resource quantities and their multipliers.
+QUANTITY_SUFFIXES = {
+    "m": 10 ** -3, "k": 10 ** 3, "M": 10 ** 6, "G": 10 ** 9, "T": 10 ** 12,
+    "Ki": 2 ** 10, "Mi": 2 ** 20, "Gi": 2 ** 30, "Ti": 2 ** 40,
+}
+
+
+def parse_quantity(quantity):
+    """
+    Returns a Kubernetes resource quantity such as 50m or 200Mi as a float
+    """
+    quantity = str(quantity)
+    for suffix in sorted(QUANTITY_SUFFIXES, key=len, reverse=True):
+        if quantity.endswith(suffix):
+            return float(quantity[:-len(suffix)]) * QUANTITY_SUFFIXES[suffix]
+    return float(quantity)
+
+
+def resource_requests(child):
+    """
+    Returns a Counter of the CPU cores and memory bytes child's pods request
+    """
+    requests = Counter()
+    if child["kind"] != "Deployment":
+        return requests
+    replicas = child["spec"].get("replicas", 1)
+    for container in child["spec"]["template"]["spec"]["containers"]:
+        for resource, quantity in container.get(
+                "resources", {}).get("requests", {}).items():
+            requests[resource] += parse_quantity(quantity) * replicas
+    return requests
+
+
+class CompiledChildren(object):
+    """
+    Child templates precompiled for every combination of component modes
+
+    Instances are never modified, so a sync keeps using the one it started
+    with while settings are reloaded.
+    """
+
+    def __init__(self, variants, default_modes, fingerprint):
+        self.variants = variants
+        self.default_modes = default_modes
+        self.fingerprint = fingerprint
+
+    def variant(self, parent):
+        """
+        Returns the child templates and expected child counts for parent
+        """
+        annotations = parent.get("metadata", {}).get("annotations", {})
+        modes = []
+        for annotation in OPTIONAL_COMPONENTS:
+            default_mode = self.default_modes[annotation]
+            mode = annotations.get(annotation, default_mode)
+            modes.append(mode in COMPONENT_MODES and mode or default_mode)
+        return self.variants[tuple(modes)]
+
+    def pipelines_ready(self, parent, children):
+        # Compute status based on observed state.
+        _, expected_child_counts = self.variant(parent)
+        return all(children.get(child_type, 0) == count
+                   for child_type, count in expected_child_counts.items())
+
+    def encode_sync(self, parent, children):
+        """
+        Returns the response to a sync of parent as a JSON string
+
+        children is the number of observed children of each type, see
+        child_counts.
+        """
+        # parent is a namespace
+        namespace = parent.get("metadata", {}).get("name")
+
+        pipeline_enabled = parent.get("metadata", {}).get(
+            "labels", {}).get("pipelines.kubeflow.org/enabled")
+
+        if pipeline_enabled != "true":
+            return json.dumps({"status": {}, "children": []})
+
+        desired_status = {
+            "kubeflow-pipelines-ready":
+                self.pipelines_ready(parent, children) and "True" or "False"
+        }
+        child_templates, _ = self.variant(parent)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Received request", extra={"fields": {
+                "namespace": namespace,
+                "parent": json.dumps(parent, sort_keys=True),
+            }})
+            logger.debug("Desired resources except secrets", extra={"fields": {
+                "namespace": namespace,
+                "children": render_children(child_templates[:-1], namespace),
+            }})
 
+        return '{"status": %s, "children": %s}' % (
+            json.dumps(desired_status),
+            render_children(child_templates, namespace))
 
-def get_settings_from_env(controller_port=None,
+
+def compile_children(visualization_server_image, visualization_server_tag,
+                     frontend_image, frontend_tag, disable_istio_sidecar,
+                     minio_access_key, minio_secret_key, minio_service_region,
+                     kfp_default_pipeline_root=None,
+                     visualization_server_mode="enabled",
+                     artifact_fetcher_mode="enabled"):
+    """
+    Returns the CompiledChildren for the given settings
+
+    Raises ValueError if a component mode is unknown.
+    """
+    # Precompute the desired child object(s), which only differ between
+    # namespaces in the namespace they are created in.
+    desired_children = []
+    if kfp_default_pipeline_root:
+        desired_children += [{
+            "apiVersion": "v1",
+            "kind": "ConfigMap",
+            "metadata": {
+                "name": "kfp-launcher",
+                "namespace": NAMESPACE_PLACEHOLDER,
+            },
+            "data": {
+                "defaultPipelineRoot": kfp_default_pipeline_root,
+            },
+        }]
+
+    desired_children += [
+        {
+            "apiVersion": "v1",
+            "kind": "ConfigMap",
+            "metadata": {
+                "name": "metadata-grpc-configmap",
+                "namespace": NAMESPACE_PLACEHOLDER,
+            },
+            "data": {
+                "METADATA_GRPC_SERVICE_HOST":
+                    "metadata-grpc-service.kubeflow",
+                "METADATA_GRPC_SERVICE_PORT": "8080",
+            },
+        },
+        # Visualization server related manifests below
+        {
+            "apiVersion": "apps/v1",
+            "kind": "Deployment",
+            "metadata": {
+                "labels": {
+                    "app": "ml-pipeline-visualizationserver"
+                },
+                "name": "ml-pipeline-visualizationserver",
+                "namespace": NAMESPACE_PLACEHOLDER,
+            },
+            "spec": {
+                "selector": {
+                    "matchLabels": {
+                        "app": "ml-pipeline-visualizationserver"
+                    },
+                },
+                "template": {
+                    "metadata": {
+                        "labels": {
+                            "app": "ml-pipeline-visualizationserver"
+                        },
+                        "annotations": disable_istio_sidecar and {
+                            "sidecar.istio.io/inject": "false"
+                        } or {},
+                    },
+                    "spec": {
+                        "containers": [{
+                            "image": f"{visualization_server_image}:{visualization_server_tag}",
+                            "imagePullPolicy":
+                                "IfNotPresent",
+                            "name":
+                                "ml-pipeline-visualizationserver",
+                            "ports": [{
+                                "containerPort": 8888
+                            }],
+                            "resources": {
+                                "requests": {
+                                    "cpu": "50m",
+                                    "memory": "200Mi"
+                                },
+                                "limits": {
+                                    "cpu": "500m",
+                                    "memory": "1Gi"
+                                },
+                            }
+                        }],
+                        "serviceAccountName":
+                            "default-editor",
+                    },
+                },
+            },
+        },
+        {
+            "apiVersion": "networking.istio.io/v1alpha3",
+            "kind": "DestinationRule",
+            "metadata": {
+                "name": "ml-pipeline-visualizationserver",
+                "namespace": NAMESPACE_PLACEHOLDER,
+            },
+            "spec": {
+                "host": "ml-pipeline-visualizationserver",
+                "trafficPolicy": {
+                    "tls": {
+                        "mode": "ISTIO_MUTUAL"
+                    }
+                }
+            }
+        },
+        {
+            "apiVersion": "security.istio.io/v1beta1",
+            "kind": "AuthorizationPolicy",
+            "metadata": {
+                "name": "ml-pipeline-visualizationserver",
+                "namespace": NAMESPACE_PLACEHOLDER,
+            },
+            "spec": {
+                "selector": {
+                    "matchLabels": {
+                        "app": "ml-pipeline-visualizationserver"
+                    }
+                },
+                "rules": [{
+                    "from": [{
+                        "source": {
+                            "principals": ["cluster.local/ns/kubeflow/sa/ml-pipeline"]
+                        }
+                    }]
+                }]
+            }
+        },
+        {
+            "apiVersion": "v1",
+            "kind": "Service",
+            "metadata": {
+                "name": "ml-pipeline-visualizationserver",
+                "namespace": NAMESPACE_PLACEHOLDER,
+            },
+            "spec": {
+                "ports": [{
+                    "name": "http",
+                    "port": 8888,
+                    "protocol": "TCP",
+                    "targetPort": 8888,
+                }],
+                "selector": {
+                    "app": "ml-pipeline-visualizationserver",
+                },
+            },
+        },
+        # Artifact fetcher related resources below.
+        {
+            "apiVersion": "apps/v1",
+            "kind": "Deployment",
+            "metadata": {
+                "labels": {
+                    "app": "ml-pipeline-ui-artifact"
+                },
+                "name": "ml-pipeline-ui-artifact",
+                "namespace": NAMESPACE_PLACEHOLDER,
+            },
+            "spec": {
+                "selector": {
+                    "matchLabels": {
+                        "app": "ml-pipeline-ui-artifact"
+                    }
+                },
+                "template": {
+                    "metadata": {
+                        "labels": {
+                            "app": "ml-pipeline-ui-artifact"
+                        },
+                        "annotations": disable_istio_sidecar and {
+                            "sidecar.istio.io/inject": "false"
+                        } or {},
+                    },
+                    "spec": {
+                        "containers": [{
+                            "name":
+                                "ml-pipeline-ui-artifact",
+                            "image": f"{frontend_image}:{frontend_tag}",
+                            "imagePullPolicy":
+                                "IfNotPresent",
+                            "ports": [{
+                                "containerPort": 3000
+                            }],
+                            "env": [
+                                {
+                                    "name": "MINIO_ACCESS_KEY",
+                                    "valueFrom": {
+                                        "secretKeyRef": {
+                                            "key": "accesskey",
+                                            "name": "mlpipeline-minio-artifact"
+                                        }
+                                    }
+                                },
+                                {
+                                    "name": "MINIO_SECRET_KEY",
+                                    "valueFrom": {
+                                        "secretKeyRef": {
+                                            "key": "secretkey",
+                                            "name": "mlpipeline-minio-artifact"
+                                        }
+                                    }
+                                },
+                                {
+                                    "name": "AWS_ACCESS_KEY_ID",
+                                    "valueFrom": {
+                                        "secretKeyRef": {
+                                            "key": "accesskey",
+                                            "name": "mlpipeline-minio-artifact"
+                                        }
+                                    }
+                                },
+                                {
+                                    "name": "AWS_SECRET_ACCESS_KEY",
+                                    "valueFrom": {
+                                        "secretKeyRef": {
+                                            "key": "secretkey",
+                                            "name": "mlpipeline-minio-artifact"
+                                        }
+                                    }
+                                },
+                                {
+                                    "name": "AWS_REGION",
+                                    "value": f"{minio_service_region}"
+                                },
+                            ],
+                            "resources": {
+                                "requests": {
+                                    "cpu": "10m",
+                                    "memory": "70Mi"
+                                },
+                                "limits": {
+                                    "cpu": "100m",
+                                    "memory": "500Mi"
+                                },
+                            }
+                        }],
+                        "serviceAccountName":
+                            "default-editor"
+                    }
+                }
+            }
+        },
+        {
+            "apiVersion": "v1",
+            "kind": "Service",
+            "metadata": {
+                "name": "ml-pipeline-ui-artifact",
+                "namespace": NAMESPACE_PLACEHOLDER,
+                "labels": {
+                    "app": "ml-pipeline-ui-artifact"
+                }
+            },
+            "spec": {
+                "ports": [{
+                    "name":
+                        "http",  # name is required to let istio understand request protocol
+                    "port": 80,
+                    "protocol": "TCP",
+                    "targetPort": 3000
+                }],
+                "selector": {
+                    "app": "ml-pipeline-ui-artifact"
+                }
+            }
+        },
+    ]
+    # Kept last so it can be left out of the logged resources because this
+    # is sensitive data.
+    desired_children.append({
+        "apiVersion": "v1",
+        "kind": "Secret",
+        "metadata": {
+            "name": "mlpipeline-minio-artifact",
+            "namespace": NAMESPACE_PLACEHOLDER,
+        },
+        "data": {
+            "accesskey": minio_access_key,
+            "secretkey": minio_secret_key,
+        },
+    })
+    default_modes = {
+        "pipelines.kubeflow.org/visualization-server": visualization_server_mode,
+        "pipelines.kubeflow.org/artifact-fetcher": artifact_fetcher_mode,
+    }
+    for annotation, mode in default_modes.items():
+        if mode not in COMPONENT_MODES:
+            raise ValueError("Unknown mode {} for {}, expected one of {}".format(
+                mode, annotation, ", ".join(COMPONENT_MODES)))
+
+    # Precompile the children for every combination of component modes, with
+    # the number of children of each type a ready namespace has. Types left
+    # out entirely are expected to have no children.
+    child_types = set(
+        "{}.{}".format(child["kind"], child["apiVersion"])
+        for child in desired_children)
+    child_variants = {}
+    for modes in itertools.product(COMPONENT_MODES,
+                                   repeat=len(OPTIONAL_COMPONENTS)):
+        component_modes = dict(zip(OPTIONAL_COMPONENTS.values(), modes))
+        variant_children = []
+        for child in desired_children:
+            mode = component_modes.get(child["metadata"]["name"], "enabled")
+            if mode == "disabled":
+                continue
+            if mode == "scaled-to-zero" and child["kind"] == "Deployment":
+                child = dict(child, spec=dict(child["spec"], replicas=0))
+            variant_children.append(child)
+        templates = [ChildTemplate(child) for child in variant_children]
+        counts = Counter(template.child_type for template in templates)
+        child_variants[modes] = (
+            templates,
+            dict((child_type, counts[child_type]) for child_type in child_types))
+
+    fingerprint = hashlib.sha256(json.dumps(
+        [desired_children, default_modes], sort_keys=True).encode('utf-8')).hexdigest()
+    return CompiledChildren(child_variants, default_modes, fingerprint)
+
+
+def read_settings_dir(settings_dir):
+    """
+    Returns a dict of the settings in settings_dir by environment variable name
+
+    settings_dir is a mounted ConfigMap or Secret volume holding one file per
+    setting, named after its environment variable. The hidden entries the
+    kubelet uses to swap in updates atomically are skipped.
+    """
+    settings = {}
+    for name in os.listdir(settings_dir):
+        path = os.path.join(settings_dir, name)
+        if name.startswith(".") or not os.path.isfile(path):
+            continue
+        with open(path) as settings_file:
+            settings[name] = settings_file.read().rstrip("\n")
+    return settings
+
+
+def watch_settings(server, settings_dir, poll_seconds):
+    """
+    Recompiles server's children whenever the files in settings_dir change
+
+    The new CompiledChildren replaces the server's in a single assignment,
+    so in-flight syncs finish with the children they started with. Cached
+    responses are dropped, and the resync backoff starts over for every
+    namespace since the settings fingerprint changed. Settings that fail to
+    compile are logged and the previous children are kept.
+    """
+    def poll():
+        current = read_settings_dir(settings_dir)
+        while True:
+            time.sleep(poll_seconds)
+            try:
+                latest = read_settings_dir(settings_dir)
+            except OSError as e:
+                logger.warning("Could not read settings", extra={"fields": {
+                    "settings_dir": settings_dir, "error": str(e)}})
+                continue
+            if latest == current:
+                continue
+            current = latest
+            try:
+                settings = get_settings_from_env(settings_dir=settings_dir)
+                compiled_children = compile_children(**dict(
+                    (name, settings[name]) for name in CHILD_SETTINGS))
+            except Exception:
+                logger.exception("Keeping previous settings", extra={"fields": {
+                    "settings_dir": settings_dir}})
+                continue
+            server.compiled_children = compiled_children
+            server.response_cache.clear()
+            logger.info("Reloaded settings", extra={"fields": {
+                "settings_dir": settings_dir,
+                "settings_fingerprint": compiled_children.fingerprint,
+            }})
+
+    thread = threading.Thread(target=poll, name="settings-watcher", daemon=True)
+    thread.start()
+    return thread
+
+
+def get_settings_from_env(controller_port=None, controller_workers=None,
+                          controller_processes=None, max_connections=None,
+                          response_cache_size=None, log_level=None,
+                          log_format=None, log_sample_rate=None,
+                          resync_not_ready_seconds=None,
+                          resync_ready_min_seconds=None,
+                          resync_ready_max_seconds=None,
+                          max_request_bytes=None, gzip_min_bytes=None,
+                          visualization_server_mode=None,
+                          artifact_fetcher_mode=None, settings_dir=None,
+                          settings_poll_seconds=None, profiling_enabled=None,
                           visualization_server_image=None, frontend_image=None,
                           visualization_server_tag=None, frontend_tag=None, disable_istio_sidecar=None,
-                          minio_access_key=None, minio_secret_key=None, minio_service_region=None, kfp_default_pipeline_root=None):
+                          minio_access_key=None, minio_secret_key=None, minio_service_region=None, kfp_default_pipeline_root=None,
+                          require_minio_credentials=True):
     """
     Returns a dict of settings from environment variables relevant to the controller
 
+    Raises MissingSettings naming every required setting that is not set.
+    Without require_minio_credentials, missing MinIO credentials are left
+    as None, for callers that do not write the MinIO Secret.
+
     Environment settings can be overridden by passing them here as arguments.
+    When settings_dir is set, the files in it override environment variables
+    of the same name, so that settings can be reloaded from a mounted
+    ConfigMap or Secret.
 
     Settings are pulled from the all-caps version of the setting name.  The
     following defaults are used if those environment variables are not set
@@ -41,382 +1345,489 @@ def get_settings_from_env(controller_port=None,
         frontend_image: gcr.io/ml-pipeline/frontend
         frontend_tag: value of KFP_VERSION environment variable
         disable_istio_sidecar: Required (no default)
-        minio_access_key: Required (no default)
-        minio_secret_key: Required (no default)
+        minio_access_key: Required (no default) unless
+            require_minio_credentials is false
+        minio_secret_key: Required (no default) unless
+            require_minio_credentials is false
+        controller_workers: 1 (a single-threaded server)
+        controller_processes: 1 (no prefork worker processes)
+        max_connections: 128 (open connections per worker process when
+            controller_workers is above one)
+        response_cache_size: None (one response per namespace, up to
+            16384 namespaces; 0 disables caching)
+        log_level: INFO (DEBUG also logs full request and response payloads)
+        log_format: text (or json)
+        log_sample_rate: 1.0 (fraction of syncs logged at INFO)
+        resync_not_ready_seconds: 15
+        resync_ready_min_seconds: 600
+        resync_ready_max_seconds: 3600 (the CompositeController's
+            resyncPeriodSeconds, which resyncs every namespace anyway)
+        max_request_bytes: 67108864 (after inflating gzip request bodies)
+        gzip_min_bytes: 1024 (smallest response sent gzip-compressed)
+        visualization_server_mode: enabled (or scaled-to-zero or disabled)
+        artifact_fetcher_mode: enabled (or scaled-to-zero or disabled)
+        settings_dir: None (settings are only read at startup)
+        settings_poll_seconds: 5
+        profiling_enabled: false (true serves /debug/profile and
+            /debug/tracemalloc)
     """
     settings = dict()
+    settings["settings_dir"] = \
+        settings_dir or \
+        os.environ.get("SETTINGS_DIR")
+
+    settings["settings_poll_seconds"] = \
+        settings_poll_seconds if settings_poll_seconds is not None \
+            else os.environ.get("SETTINGS_POLL_SECONDS", "5")
+
+    environ = dict(os.environ)
+    if settings["settings_dir"]:
+        environ.update(read_settings_dir(settings["settings_dir"]))
+
     settings["controller_port"] = \
-        controller_port or \
-        os.environ.get("CONTROLLER_PORT", "8080")
+        controller_port if controller_port is not None \
+            else environ.get("CONTROLLER_PORT", "8080")
+
+    settings["controller_workers"] = \
+        controller_workers if controller_workers is not None \
+            else environ.get("CONTROLLER_WORKERS", "1")
+
+    settings["controller_processes"] = \
+        controller_processes if controller_processes is not None \
+            else environ.get("CONTROLLER_PROCESSES", "1")
+
+    settings["max_connections"] = \
+        max_connections if max_connections is not None \
+            else environ.get("MAX_CONNECTIONS", "128")
+
+    settings["response_cache_size"] = \
+        response_cache_size if response_cache_size is not None \
+            else environ.get("RESPONSE_CACHE_SIZE")
+
+    settings["log_level"] = \
+        log_level or \
+        environ.get("LOG_LEVEL", "INFO")
+
+    settings["log_format"] = \
+        log_format or \
+        environ.get("LOG_FORMAT", "text")
+
+    settings["log_sample_rate"] = \
+        log_sample_rate if log_sample_rate is not None \
+            else environ.get("LOG_SAMPLE_RATE", "1.0")
+
+    settings["resync_not_ready_seconds"] = \
+        resync_not_ready_seconds if resync_not_ready_seconds is not None \
+            else environ.get("RESYNC_NOT_READY_SECONDS", "15")
+
+    settings["resync_ready_min_seconds"] = \
+        resync_ready_min_seconds if resync_ready_min_seconds is not None \
+            else environ.get("RESYNC_READY_MIN_SECONDS", "600")
+
+    settings["resync_ready_max_seconds"] = \
+        resync_ready_max_seconds if resync_ready_max_seconds is not None \
+            else environ.get("RESYNC_READY_MAX_SECONDS", "3600")
+
+    settings["max_request_bytes"] = \
+        max_request_bytes if max_request_bytes is not None \
+            else environ.get("MAX_REQUEST_BYTES", str(64 * 1024 * 1024))
+
+    settings["gzip_min_bytes"] = \
+        gzip_min_bytes if gzip_min_bytes is not None \
+            else environ.get("GZIP_MIN_BYTES", "1024")
+
+    settings["profiling_enabled"] = \
+        profiling_enabled if profiling_enabled is not None \
+            else environ.get("PROFILING_ENABLED") == "true"
+
+    settings["visualization_server_mode"] = \
+        visualization_server_mode or \
+        environ.get("VISUALIZATION_SERVER_MODE", "enabled")
+
+    settings["artifact_fetcher_mode"] = \
+        artifact_fetcher_mode or \
+        environ.get("ARTIFACT_FETCHER_MODE", "enabled")
 
     settings["visualization_server_image"] = \
         visualization_server_image or \
-        os.environ.get("VISUALIZATION_SERVER_IMAGE", "gcr.io/ml-pipeline/visualization-server")
+        environ.get("VISUALIZATION_SERVER_IMAGE", "gcr.io/ml-pipeline/visualization-server")
 
     settings["frontend_image"] = \
         frontend_image or \
-        os.environ.get("FRONTEND_IMAGE", "gcr.io/ml-pipeline/frontend")
+        environ.get("FRONTEND_IMAGE", "gcr.io/ml-pipeline/frontend")
 
     # Look for specific tags for each image first, falling back to
     # previously used KFP_VERSION environment variable for backwards
     # compatibility
     settings["visualization_server_tag"] = \
         visualization_server_tag or \
-        os.environ.get("VISUALIZATION_SERVER_TAG") or \
-        os.environ["KFP_VERSION"]
+        environ.get("VISUALIZATION_SERVER_TAG") or \
+        environ.get("KFP_VERSION")
 
     settings["frontend_tag"] = \
         frontend_tag or \
-        os.environ.get("FRONTEND_TAG") or \
-        os.environ["KFP_VERSION"]
+        environ.get("FRONTEND_TAG") or \
+        environ.get("KFP_VERSION")
 
     settings["disable_istio_sidecar"] = \
         disable_istio_sidecar if disable_istio_sidecar is not None \
-            else os.environ.get("DISABLE_ISTIO_SIDECAR") == "true"
+            else environ.get("DISABLE_ISTIO_SIDECAR") == "true"
 
     settings["minio_access_key"] = \
         minio_access_key or \
-        base64.b64encode(bytes(os.environ.get("MINIO_ACCESS_KEY"), 'utf-8')).decode('utf-8')
+        base64_setting(environ.get("MINIO_ACCESS_KEY"))
 
     settings["minio_secret_key"] = \
         minio_secret_key or \
-        base64.b64encode(bytes(os.environ.get("MINIO_SECRET_KEY"), 'utf-8')).decode('utf-8')
+        base64_setting(environ.get("MINIO_SECRET_KEY"))
 
     settings["minio_service_region"] = \
         minio_service_region or \
-        os.environ.get("MINIO_SERVICE_REGION", "us-east-1")
+        environ.get("MINIO_SERVICE_REGION", "us-east-1")
 
 
     # KFP_DEFAULT_PIPELINE_ROOT is optional
     settings["kfp_default_pipeline_root"] = \
         kfp_default_pipeline_root or \
-        os.environ.get("KFP_DEFAULT_PIPELINE_ROOT")
+        environ.get("KFP_DEFAULT_PIPELINE_ROOT")
+
+    missing = []
+    if settings["visualization_server_tag"] is None:
+        missing.append("VISUALIZATION_SERVER_TAG (or KFP_VERSION)")
+    if settings["frontend_tag"] is None:
+        missing.append("FRONTEND_TAG (or KFP_VERSION)")
+    if require_minio_credentials:
+        missing.extend(name for name in ("MINIO_ACCESS_KEY", "MINIO_SECRET_KEY")
+                       if settings[name.lower()] is None)
+    if missing:
+        raise MissingSettings(
+            "Missing required settings: {}".format(", ".join(missing)))
 
     return settings
 
 
+def base64_setting(value):
+    """
+    Returns a setting encoded as Secret data, or None if it is not set
+    """
+    if value is None:
+        return None
+    return base64.b64encode(bytes(value, 'utf-8')).decode('utf-8')
+
+
 def server_factory(visualization_server_image,
                    visualization_server_tag, frontend_image, frontend_tag,
                    disable_istio_sidecar, minio_access_key,
                    minio_secret_key, minio_service_region, kfp_default_pipeline_root=None,
-                   url="", controller_port=8080):
+                   url="", controller_port=8080, controller_workers=1,
+                   max_connections=128,
+                   response_cache_size=None, log_sample_rate=1.0,
+                   reuse_port=False, metrics=None,
+                   resync_not_ready_seconds=15, resync_ready_min_seconds=600,
+                   resync_ready_max_seconds=3600,
+                   max_request_bytes=64 * 1024 * 1024, gzip_min_bytes=1024,
+                   visualization_server_mode="enabled",
+                   artifact_fetcher_mode="enabled", settings_dir=None,
+                   settings_poll_seconds=5, profiling_enabled=False):
     """
     Returns an HTTPServer populated with Handler with customized settings
+
+    When controller_workers is greater than one, each connection is served
+    by a thread of its own and kept alive between syncs, and at most
+    controller_workers syncs are processed at a time. Request bodies are read
+    before a sync waits for its turn, and connections beyond
+    max_connections are closed, so at most max_connections bodies of up to
+    max_request_bytes are held at once.
+
+    Serialized responses are kept in an LRU cache of response_cache_size
+    entries, or of the latest response of each namespace when it is None,
+    exposed as the server's response_cache. The parent and child counts of
+    each request body are kept in another, exposed as the server's
+    parsed_requests, so unchanged resyncs are not parsed again. Prometheus
+    metrics are served on /metrics and exposed as the server's metrics; pass
+    metrics to share them with other worker processes.
+
+    Responses ask metacontroller to resync namespaces that are not ready
+    after resync_not_ready_seconds, and ready or disabled namespaces after a
+    period that doubles from resync_ready_min_seconds up to
+    resync_ready_max_seconds while the namespace and settings are unchanged.
+    Each worker process keeps its own periods, so they are approximate when
+    there are several.
+
+    The visualization server and artifact fetcher are created, scaled to
+    zero or left out according to the namespace's
+    pipelines.kubeflow.org/visualization-server and
+    pipelines.kubeflow.org/artifact-fetcher annotations, defaulting to
+    visualization_server_mode and artifact_fetcher_mode.
+
+    Request bodies may be gzip-encoded and are rejected once they exceed
+    max_request_bytes. Responses of at least gzip_min_bytes are compressed
+    for clients that accept gzip.
+
+    With reuse_port, the server's socket is bound with SO_REUSEPORT so
+    several worker processes can listen on controller_port.
+
+    A log_sample_rate fraction of syncs is logged at INFO with its namespace,
+    latency and payload sizes.
+
+    With profiling_enabled, /debug/profile and /debug/tracemalloc profile
+    live traffic on demand. A profile occupies its thread for its duration, so
+    syncs are only served meanwhile when controller_workers is greater than
+    one, and only the worker process handling the request is profiled.
+
+    When settings_dir is set, it is polled every settings_poll_seconds and
+    the desired children are recompiled from the environment and
+    settings_dir whenever its files change, without restarting the server.
     """
+    compiled_children = compile_children(
+        visualization_server_image, visualization_server_tag, frontend_image,
+        frontend_tag, disable_istio_sidecar, minio_access_key,
+        minio_secret_key, minio_service_region, kfp_default_pipeline_root,
+        visualization_server_mode, artifact_fetcher_mode)
+    if response_cache_size is not None:
+        response_cache_size = int(response_cache_size)
+    response_cache = ResponseCache(response_cache_size)
+    # Parents and child counts of sync requests, by digest of the body.
+    parsed_requests = ResponseCache(response_cache_size)
+    metrics = metrics or ControllerMetrics()
+    log_sample_rate = float(log_sample_rate)
+    resync_backoff = ResyncBackoff(int(resync_not_ready_seconds),
+                                   int(resync_ready_min_seconds),
+                                   int(resync_ready_max_seconds))
+    max_request_bytes = int(max_request_bytes)
+    gzip_min_bytes = int(gzip_min_bytes)
+    # Only one profile or allocation trace runs at a time.
+    profiling_lock = threading.Lock()
+
     class Controller(BaseHTTPRequestHandler):
         def sync(self, parent, children):
-            # parent is a namespace
-            namespace = parent.get("metadata", {}).get("name")
+            return json.loads(self.server.compiled_children.encode_sync(
+                parent, child_counts(children)))
+
+        def do_POST(self):
+            start = time.monotonic()
+            request_body = self.read_body()
+            if request_body is None:
+                return
+            # The body is read before waiting here, so slow clients and idle
+            # keep-alive connections only hold their own thread and never
+            # delay syncs.
+            with self.server.sync_slots:
+                profile_session = self.server.profile_session
+                if profile_session is not None:
+                    profile_session.run(self.serve_post, request_body, start)
+                else:
+                    self.serve_post(request_body, start)
+
+        def read_body(self):
+            """
+            Returns the request body, or None once an error is sent for it
+            """
+            content_length = self.headers.get("content-length")
+            if content_length is None:
+                self.send_error(411)
+                return None
+            gzip_encoded = self.headers.get(
+                "content-encoding", "").strip().lower() == "gzip"
+            try:
+                return read_request_body(self.rfile, int(content_length),
+                                         gzip_encoded, max_request_bytes)
+            except RequestTooLarge:
+                # The rest of the body is never read, so the connection can
+                # not be reused.
+                self.close_connection = True
+                self.send_error(413)
+            except (ValueError, zlib.error) as e:
+                self.close_connection = True
+                self.send_error(400, str(e))
+            return None
 
-            pipeline_enabled = parent.get("metadata", {}).get(
-                "labels", {}).get("pipelines.kubeflow.org/enabled")
+        def serve_post(self, request_body, start):
+            # Serve the sync() function as a JSON webhook.
+            request_bytes = int(self.headers.get("content-length"))
+            # Metacontroller resends the same observed state on every
+            # resync of an unchanged namespace, so requests are only parsed
+            # the first time their body is seen.
+            body_digest = hashlib.sha256(request_body).digest()
+            observed = parsed_requests.get(body_digest)
+            metrics.parsed_request_lookups.inc(
+                observed is not None and "hit" or "miss")
+            if observed is None:
+                decode_start = time.monotonic()
+                request = json.loads(request_body)
+                observed = (request["parent"],
+                            child_counts(request["children"]))
+                metrics.json_decode_duration.observe(
+                    time.monotonic() - decode_start)
+                parsed_requests.put(body_digest, observed,
+                                    observed[0].get("metadata", {}).get("name"))
+            parent, children = observed
+            metadata = parent.get("metadata", {})
+            # Settings may be reloaded while this sync is served.
+            compiled_children = self.server.compiled_children
 
+            pipeline_enabled = metadata.get("labels", {}).get(
+                "pipelines.kubeflow.org/enabled")
             if pipeline_enabled != "true":
-                return {"status": {}, "children": []}
-
-            desired_configmap_count = 1
-            desired_resources = []
-            if kfp_default_pipeline_root:
-                desired_configmap_count = 2
-                desired_resources += [{
-                    "apiVersion": "v1",
-                    "kind": "ConfigMap",
-                    "metadata": {
-                        "name": "kfp-launcher",
-                        "namespace": namespace,
-                    },
-                    "data": {
-                        "defaultPipelineRoot": kfp_default_pipeline_root,
-                    },
-                }]
+                status = "disabled"
+            elif compiled_children.pipelines_ready(parent, children):
+                status = "ready"
+            else:
+                status = "not_ready"
 
+            cache_key = sync_cache_key(
+                compiled_children.fingerprint, parent, children)
+            body = response_cache.get(cache_key)
+            cache_hit = body is not None
+            metrics.response_cache_lookups.inc(cache_hit and "hit" or "miss")
+            if not cache_hit:
+                encode_start = time.monotonic()
+                body = bytes(compiled_children.encode_sync(
+                    parent, children), 'utf-8')
+                metrics.json_encode_duration.observe(
+                    time.monotonic() - encode_start)
+                response_cache.put(cache_key, body, metadata.get("name"))
 
-            # Compute status based on observed state.
-            desired_status = {
-                "kubeflow-pipelines-ready":
-                    len(children["Secret.v1"]) == 1 and
-                    len(children["ConfigMap.v1"]) == desired_configmap_count and
-                    len(children["Deployment.apps/v1"]) == 2 and
-                    len(children["Service.v1"]) == 2 and
-                    len(children["DestinationRule.networking.istio.io/v1alpha3"]) == 1 and
-                    len(children["AuthorizationPolicy.security.istio.io/v1beta1"]) == 1 and
-                    "True" or "False"
-            }
+            resync_after = resync_backoff.next_period(
+                metadata.get("name"),
+                metadata.get("generation", metadata.get("resourceVersion")),
+                compiled_children.fingerprint, status != "not_ready")
+            if metadata.get("deletionTimestamp"):
+                # The namespace is going away and will not be synced again.
+                resync_backoff.forget(metadata.get("name"))
+            body = with_resync_after(body, resync_after)
 
-            # Generate the desired child object(s).
-            desired_resources += [
-                {
-                    "apiVersion": "v1",
-                    "kind": "ConfigMap",
-                    "metadata": {
-                        "name": "metadata-grpc-configmap",
-                        "namespace": namespace,
-                    },
-                    "data": {
-                        "METADATA_GRPC_SERVICE_HOST":
-                            "metadata-grpc-service.kubeflow",
-                        "METADATA_GRPC_SERVICE_PORT": "8080",
-                    },
-                },
-                # Visualization server related manifests below
-                {
-                    "apiVersion": "apps/v1",
-                    "kind": "Deployment",
-                    "metadata": {
-                        "labels": {
-                            "app": "ml-pipeline-visualizationserver"
-                        },
-                        "name": "ml-pipeline-visualizationserver",
-                        "namespace": namespace,
-                    },
-                    "spec": {
-                        "selector": {
-                            "matchLabels": {
-                                "app": "ml-pipeline-visualizationserver"
-                            },
-                        },
-                        "template": {
-                            "metadata": {
-                                "labels": {
-                                    "app": "ml-pipeline-visualizationserver"
-                                },
-                                "annotations": disable_istio_sidecar and {
-                                    "sidecar.istio.io/inject": "false"
-                                } or {},
-                            },
-                            "spec": {
-                                "containers": [{
-                                    "image": f"{visualization_server_image}:{visualization_server_tag}",
-                                    "imagePullPolicy":
-                                        "IfNotPresent",
-                                    "name":
-                                        "ml-pipeline-visualizationserver",
-                                    "ports": [{
-                                        "containerPort": 8888
-                                    }],
-                                    "resources": {
-                                        "requests": {
-                                            "cpu": "50m",
-                                            "memory": "200Mi"
-                                        },
-                                        "limits": {
-                                            "cpu": "500m",
-                                            "memory": "1Gi"
-                                        },
-                                    }
-                                }],
-                                "serviceAccountName":
-                                    "default-editor",
-                            },
-                        },
-                    },
-                },
-                {
-                    "apiVersion": "networking.istio.io/v1alpha3",
-                    "kind": "DestinationRule",
-                    "metadata": {
-                        "name": "ml-pipeline-visualizationserver",
-                        "namespace": namespace,
-                    },
-                    "spec": {
-                        "host": "ml-pipeline-visualizationserver",
-                        "trafficPolicy": {
-                            "tls": {
-                                "mode": "ISTIO_MUTUAL"
-                            }
-                        }
-                    }
-                },
-                {
-                    "apiVersion": "security.istio.io/v1beta1",
-                    "kind": "AuthorizationPolicy",
-                    "metadata": {
-                        "name": "ml-pipeline-visualizationserver",
-                        "namespace": namespace,
-                    },
-                    "spec": {
-                        "selector": {
-                            "matchLabels": {
-                                "app": "ml-pipeline-visualizationserver"
-                            }
-                        },
-                        "rules": [{
-                            "from": [{
-                                "source": {
-                                    "principals": ["cluster.local/ns/kubeflow/sa/ml-pipeline"]
-                                }
-                            }]
-                        }]
-                    }
-                },
-                {
-                    "apiVersion": "v1",
-                    "kind": "Service",
-                    "metadata": {
-                        "name": "ml-pipeline-visualizationserver",
-                        "namespace": namespace,
-                    },
-                    "spec": {
-                        "ports": [{
-                            "name": "http",
-                            "port": 8888,
-                            "protocol": "TCP",
-                            "targetPort": 8888,
-                        }],
-                        "selector": {
-                            "app": "ml-pipeline-visualizationserver",
-                        },
-                    },
-                },
-                # Artifact fetcher related resources below.
-                {
-                    "apiVersion": "apps/v1",
-                    "kind": "Deployment",
-                    "metadata": {
-                        "labels": {
-                            "app": "ml-pipeline-ui-artifact"
-                        },
-                        "name": "ml-pipeline-ui-artifact",
-                        "namespace": namespace,
-                    },
-                    "spec": {
-                        "selector": {
-                            "matchLabels": {
-                                "app": "ml-pipeline-ui-artifact"
-                            }
-                        },
-                        "template": {
-                            "metadata": {
-                                "labels": {
-                                    "app": "ml-pipeline-ui-artifact"
-                                },
-                                "annotations": disable_istio_sidecar and {
-                                    "sidecar.istio.io/inject": "false"
-                                } or {},
-                            },
-                            "spec": {
-                                "containers": [{
-                                    "name":
-                                        "ml-pipeline-ui-artifact",
-                                    "image": f"{frontend_image}:{frontend_tag}",
-                                    "imagePullPolicy":
-                                        "IfNotPresent",
-                                    "ports": [{
-                                        "containerPort": 3000
-                                    }],
-                                    "env": [
-                                        {
-                                            "name": "MINIO_ACCESS_KEY",
-                                            "valueFrom": {
-                                                "secretKeyRef": {
-                                                    "key": "accesskey",
-                                                    "name": "mlpipeline-minio-artifact"
-                                                }
-                                            }
-                                        },
-                                        {
-                                            "name": "MINIO_SECRET_KEY",
-                                            "valueFrom": {
-                                                "secretKeyRef": {
-                                                    "key": "secretkey",
-                                                    "name": "mlpipeline-minio-artifact"
-                                                }
-                                            }
-                                        },
-                                        {
-                                            "name": "AWS_ACCESS_KEY_ID",
-                                            "valueFrom": {
-                                                "secretKeyRef": {
-                                                    "key": "accesskey",
-                                                    "name": "mlpipeline-minio-artifact"
-                                                }
-                                            }
-                                        },
-                                        {
-                                            "name": "AWS_SECRET_ACCESS_KEY",
-                                            "valueFrom": {
-                                                "secretKeyRef": {
-                                                    "key": "secretkey",
-                                                    "name": "mlpipeline-minio-artifact"
-                                                }
-                                            }
-                                        },
-                                        {
-                                            "name": "AWS_REGION",
-                                            "value": f"{minio_service_region}"
-                                        },
-                                    ],
-                                    "resources": {
-                                        "requests": {
-                                            "cpu": "10m",
-                                            "memory": "70Mi"
-                                        },
-                                        "limits": {
-                                            "cpu": "100m",
-                                            "memory": "500Mi"
-                                        },
-                                    }
-                                }],
-                                "serviceAccountName":
-                                    "default-editor"
-                            }
-                        }
-                    }
-                },
-                {
-                    "apiVersion": "v1",
-                    "kind": "Service",
-                    "metadata": {
-                        "name": "ml-pipeline-ui-artifact",
-                        "namespace": namespace,
-                        "labels": {
-                            "app": "ml-pipeline-ui-artifact"
-                        }
-                    },
-                    "spec": {
-                        "ports": [{
-                            "name":
-                                "http",  # name is required to let istio understand request protocol
-                            "port": 80,
-                            "protocol": "TCP",
-                            "targetPort": 3000
-                        }],
-                        "selector": {
-                            "app": "ml-pipeline-ui-artifact"
-                        }
-                    }
-                },
-            ]
-            print('Received request:\n', json.dumps(parent, sort_keys=True))
-            print('Desired resources except secrets:\n', json.dumps(desired_resources, sort_keys=True))
-            # Moved after the print argument because this is sensitive data.
-            desired_resources.append({
-                "apiVersion": "v1",
-                "kind": "Secret",
-                "metadata": {
-                    "name": "mlpipeline-minio-artifact",
-                    "namespace": namespace,
-                },
-                "data": {
-                    "accesskey": minio_access_key,
-                    "secretkey": minio_secret_key,
-                },
-            })
+            self.send_response(200)
+            self.send_header("Content-type", "application/json")
+            self.send_header("Vary", "Accept-Encoding")
+            if len(body) >= gzip_min_bytes and \
+                    accepts_gzip(self.headers.get("accept-encoding")):
+                body = gzip.compress(body, compresslevel=1)
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
 
-            return {"status": desired_status, "children": desired_resources}
+            latency = time.monotonic() - start
+            metrics.namespaces_synced.inc(status)
+            metrics.sync_duration.observe(latency)
+            metrics.request_size.observe(request_bytes)
+            metrics.response_size.observe(len(body))
 
-        def do_POST(self):
-            # Serve the sync() function as a JSON webhook.
-            observed = json.loads(
-                self.rfile.read(int(self.headers.get("content-length"))))
-            desired = self.sync(observed["parent"], observed["children"])
+            if logger.isEnabledFor(logging.INFO) and \
+                    random.random() < log_sample_rate:
+                logger.info("Synced namespace", extra={"fields": {
+                    "namespace": metadata.get("name"),
+                    "status": status,
+                    "latency_ms": round(latency * 1000, 3),
+                    "request_bytes": request_bytes,
+                    "response_bytes": len(body),
+                    "cache_hit": cache_hit,
+                    "resync_after_seconds": resync_after,
+                }})
 
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path == "/metrics":
+                self.send_text(metrics.expose(), "text/plain; version=0.0.4")
+            elif profiling_enabled and url.path in ("/debug/profile",
+                                                    "/debug/tracemalloc"):
+                self.debug(url.path, parse_qs(url.query))
+            else:
+                self.send_error(404)
+
+        def debug(self, path, query):
+            """
+            Serves /debug/profile and /debug/tracemalloc
+
+            /debug/profile?seconds=N samples the stacks of every thread for N
+            seconds and returns them collapsed for flame graph tools;
+            mode=cprofile instead returns the pstats of the requests served
+            in that time. /debug/tracemalloc?seconds=N&limit=M returns the M
+            source lines that allocated the most memory during N seconds.
+            """
+            try:
+                seconds = float(query.get("seconds", ["30"])[0])
+                limit = int(query.get("limit", ["50"])[0])
+            except ValueError as e:
+                self.send_error(400, str(e))
+                return
+            if not 0 < seconds <= MAX_PROFILE_SECONDS:
+                self.send_error(400, "seconds must be between 0 and {}".format(
+                    MAX_PROFILE_SECONDS))
+                return
+            if not profiling_lock.acquire(blocking=False):
+                self.send_error(409, "A profile is already running")
+                return
+            try:
+                logger.info("Profiling", extra={"fields": {
+                    "path": path, "seconds": seconds}})
+                if path == "/debug/tracemalloc":
+                    report = top_allocations(seconds, limit)
+                elif query.get("mode", ["sample"])[0] == "cprofile":
+                    self.server.profile_session = ProfileSession()
+                    time.sleep(seconds)
+                    report = self.server.profile_session.report(limit)
+                else:
+                    stacks = sample_stacks(seconds,
+                                           PROFILE_SAMPLE_INTERVAL_SECONDS,
+                                           exclude_thread=threading.get_ident())
+                    report = "".join("{} {}\n".format(stack, count)
+                                     for stack, count in stacks.most_common())
+            finally:
+                self.server.profile_session = None
+                profiling_lock.release()
+            self.send_text(report, "text/plain")
+
+        def send_text(self, text, content_type):
+            body = bytes(text, 'utf-8')
             self.send_response(200)
-            self.send_header("Content-type", "application/json")
+            self.send_header("Content-type", content_type)
+            self.send_header("Content-Length", str(len(body)))
             self.end_headers()
-            self.wfile.write(bytes(json.dumps(desired), 'utf-8'))
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Access logs would repeat the sync log line for every request.
+            logger.debug(format, *args)
+
+        def log_error(self, format, *args):
+            logger.warning(format, *args)
 
-    return HTTPServer((url, int(controller_port)), Controller)
+    controller_workers = int(controller_workers)
+    if controller_workers <= 1:
+        server = HTTPServer((url, int(controller_port)), Controller,
+                            bind_and_activate=False)
+    else:
+        # Keep connections from metacontroller open between syncs; the timeout
+        # releases threads of idle connections. Headers and body are
+        # written separately, so Nagle's algorithm would delay every
+        # kept-alive response.
+        Controller.protocol_version = "HTTP/1.1"
+        Controller.timeout = KEEPALIVE_TIMEOUT_SECONDS
+        Controller.disable_nagle_algorithm = True
+        server = ConnectionThreadHTTPServer(
+            (url, int(controller_port)), Controller, bind_and_activate=False,
+            max_connections=int(max_connections))
+    try:
+        if reuse_port:
+            server.socket.setsockopt(
+                socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        server.server_bind()
+        server.server_activate()
+    except Exception:
+        server.server_close()
+        raise
+    server.sync_slots = threading.BoundedSemaphore(max(controller_workers, 1))
+    server.compiled_children = compiled_children
+    server.response_cache = response_cache
+    server.parsed_requests = parsed_requests
+    server.resync_backoff = resync_backoff
+    server.metrics = metrics
+    server.profile_session = None
+    if settings_dir:
+        watch_settings(server, settings_dir, float(settings_poll_seconds))
+    return server
 
 
 if __name__ == "__main__":
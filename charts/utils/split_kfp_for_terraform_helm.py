@@ -1,42 +1,175 @@
 import argparse
+import base64
+import glob
+import gzip
+import json
 import os
-import subprocess
 import shutil
 
-parser = argparse.ArgumentParser(description='Split KFP helm charts since terraform fails with helm charts of a certain size.')
-parser.add_argument('--helm-chart-folder', dest='helm_chart_folder', help='helm chart folder')
-parser.add_argument('--overwrite', default=False, help='recreates the folders if they already exist')
+# Helm stores every release in a Secret, which Kubernetes limits to 1MiB.
+HELM_RELEASE_SECRET_LIMIT_BYTES = 1024 * 1024
 
-args = parser.parse_args()
+# Releases of this size install with terraform's helm provider. It is also
+# the budget that splits the KFP vanilla chart as the former hand-written
+# lists did, dependencies in the first part and workloads in the second.
+DEFAULT_MAX_PART_BYTES = 40 * 1024
 
-kfp_chart_path = os.path.abspath(args.helm_chart_folder)
-kfp_chart_path_parent = os.path.dirname(kfp_chart_path)
-overwrite_folders = args.overwrite
+# The order helm installs kinds in (InstallOrder in helm's
+# pkg/releaseutil/kind_sorter.go). Kinds not listed are installed last, in
+# alphabetical order.
+INSTALL_ORDER = [
+    'PriorityClass', 'Namespace', 'NetworkPolicy', 'ResourceQuota', 'LimitRange',
+    'PodSecurityPolicy', 'PodDisruptionBudget', 'ServiceAccount', 'Secret',
+    'SecretList', 'ConfigMap', 'StorageClass', 'PersistentVolume',
+    'PersistentVolumeClaim', 'CustomResourceDefinition', 'ClusterRole',
+    'ClusterRoleList', 'ClusterRoleBinding', 'ClusterRoleBindingList', 'Role',
+    'RoleList', 'RoleBinding', 'RoleBindingList', 'Service', 'DaemonSet', 'Pod',
+    'ReplicationController', 'ReplicaSet', 'Deployment', 'HorizontalPodAutoscaler',
+    'StatefulSet', 'Job', 'CronJob', 'IngressClass', 'Ingress', 'APIService',
+]
 
-folder_prefix = os.path.basename(kfp_chart_path) + "-part"
 
-split_1_path = os.path.join(kfp_chart_path_parent, f"{folder_prefix}-1")
-split_2_path = os.path.join(kfp_chart_path_parent, f"{folder_prefix}-2")
+def chart_files(chart_path):
+    """Returns the paths of every file in the chart, relative to the chart folder."""
+    paths = []
+    for root, _, files in os.walk(chart_path):
+        for file in files:
+            paths.append(os.path.relpath(os.path.join(root, file), chart_path))
+    return sorted(paths)
 
-if overwrite_folders:
-    shutil.rmtree(split_1_path)
-    shutil.rmtree(split_2_path)
-elif os.path.exists(split_1_path) or os.path.exists(split_2_path):
-    print("Skipping creation, a folder already exists and overwrite is false.")
-    raise Exception("Folder(s) already exists")
 
-split_1_desired = ['Role', 'Certificate', 'PriorityClass', 'ClusterRoleBinding', 'ClusterRole', 'RoleBinding', 'MutatingWebhookConfiguration', 'ServiceAccount', 'Secret', 'ConfigMap', 'Service', 'VirtualService', 'Issuer']
+def template_kind(path):
+    """Returns the kind of a template file, or None if it does not render a manifest.
 
-split_2_desired = ['CompositeController', 'StatefulSet', 'PersistentVolumeClaim', 'DestinationRule', 'AuthorizationPolicy', 'Deployment']
+    Helmify puts every object in templates/<Kind>, files directly under
+    templates, such as _helpers.tpl or NOTES.txt, are not counted as objects.
+    """
+    parts = path.split(os.sep)
+    if parts[0] != 'templates' or len(parts) < 3:
+        return None
+    return parts[1]
 
-def keep_folders(path, desired):
-    for root, dirs, _ in os.walk(os.path.join(path, "templates")):
-        for dir in dirs:
-            if dir not in desired:
-                shutil.rmtree(os.path.join(root, dir))
 
-shutil.copytree(kfp_chart_path, split_1_path)
-shutil.copytree(kfp_chart_path, split_2_path)
+def install_order_key(kind):
+    if kind in INSTALL_ORDER:
+        return 0, INSTALL_ORDER.index(kind), ''
+    return 1, 0, kind
 
-keep_folders(split_1_path, split_1_desired)
-keep_folders(split_2_path, split_2_desired)
\ No newline at end of file
+
+def release_payload_bytes(chart_path, paths):
+    """Returns the size of the release helm would store for a chart of paths.
+
+    Helm serializes the release, which holds every chart file base64-encoded
+    and the rendered manifest, as JSON, then gzips and base64-encodes it into
+    the release Secret. Helmify templates render as they are, so the
+    templates stand in for the manifest.
+    """
+    chart_name = os.path.basename(chart_path)
+    files, templates, manifest = [], [], []
+    for path in paths:
+        with open(os.path.join(chart_path, path), 'rb') as file:
+            data = file.read()
+        entry = {'name': path, 'data': base64.b64encode(data).decode('utf-8')}
+        if path.split(os.sep)[0] != 'templates':
+            files.append(entry)
+            continue
+        templates.append(entry)
+        if not os.path.basename(path).startswith('_'):
+            manifest.append(f"---\n# Source: {chart_name}/{path}\n{data.decode('utf-8')}")
+    release = {
+        'name': chart_name,
+        'chart': {'files': files, 'templates': templates},
+        'manifest': ''.join(manifest),
+    }
+    return len(base64.b64encode(gzip.compress(json.dumps(release).encode('utf-8'))))
+
+
+def partition_chart(chart_path, max_part_bytes):
+    """Splits the templates of a chart into as few parts as fit max_part_bytes.
+
+    Every part gets the files shared by the chart (Chart.yaml, values.yaml,
+    helpers), the first part also gets the crds folder. Templates are taken
+    in the order helm installs their kinds and fill one part after the
+    other, so every kind of a part is installed at or after the kinds of the
+    parts before it. A part is closed at the first kind that does not fit
+    whole, kinds are only split across parts if they do not fit a part of
+    their own. Sizes are release_payload_bytes.
+
+    Returns the parts, each a list of paths relative to the chart folder, and
+    the number of bytes of each part.
+    """
+    shared, crds, templates = [], [], []
+    for path in chart_files(chart_path):
+        kind = template_kind(path)
+        if path.split(os.sep)[0] == 'crds':
+            crds.append(path)
+        elif kind is not None:
+            templates.append(path)
+        else:
+            shared.append(path)
+
+    def payload(part):
+        return release_payload_bytes(chart_path, shared + part)
+
+    kinds = sorted({template_kind(path) for path in templates}, key=install_order_key)
+    parts = [list(crds)]
+    if payload(parts[0]) > max_part_bytes:
+        raise Exception(f"The crds of {chart_path} take {payload(parts[0])} bytes, "
+                        f"more than the {max_part_bytes} bytes of a part")
+
+    for kind in kinds:
+        kind_templates = [path for path in templates if template_kind(path) == kind]
+        if payload(parts[-1] + kind_templates) <= max_part_bytes:
+            parts[-1] += kind_templates
+            continue
+        if parts[-1]:
+            parts.append([])
+        for path in kind_templates:
+            if payload(parts[-1] + [path]) > max_part_bytes:
+                if not parts[-1]:
+                    raise Exception(f"{path} takes {payload([path])} bytes with the chart's shared files, "
+                                    f"more than the {max_part_bytes} bytes of a part")
+                parts.append([])
+            parts[-1].append(path)
+
+    return [sorted(shared + part) for part in parts], [payload(part) for part in parts]
+
+
+def write_part(chart_path, part_path, paths):
+    for path in paths:
+        target = os.path.join(part_path, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copy2(os.path.join(chart_path, path), target)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Split helm charts since terraform fails with helm charts of a certain size.')
+    parser.add_argument('--helm-chart-folder', dest='helm_chart_folder', help='helm chart folder')
+    parser.add_argument('--overwrite', default=False, help='recreates the folders if they already exist')
+    parser.add_argument('--max-part-bytes', type=int, default=DEFAULT_MAX_PART_BYTES,
+                        help='maximum size of the release helm stores for each part, gzipped and base64-encoded')
+
+    args = parser.parse_args()
+
+    if args.max_part_bytes > HELM_RELEASE_SECRET_LIMIT_BYTES:
+        raise Exception(f"--max-part-bytes can not exceed the {HELM_RELEASE_SECRET_LIMIT_BYTES} bytes "
+                        f"of the Secret helm stores a release in")
+
+    chart_path = os.path.abspath(args.helm_chart_folder)
+    folder_prefix = os.path.join(os.path.dirname(chart_path), os.path.basename(chart_path) + "-part")
+
+    # partition first, so existing parts are kept if the chart does not fit
+    parts, part_bytes = partition_chart(chart_path, args.max_part_bytes)
+
+    existing_paths = glob.glob(f"{folder_prefix}-*")
+    if existing_paths and args.overwrite:
+        for path in existing_paths:
+            shutil.rmtree(path)
+    elif existing_paths:
+        print("Skipping creation, a folder already exists and overwrite is false.")
+        raise Exception("Folder(s) already exists")
+
+    for i, paths in enumerate(parts):
+        part_path = f"{folder_prefix}-{i + 1}"
+        write_part(chart_path, part_path, paths)
+        print(f"{part_path}: {len(paths)} files, {part_bytes[i]} bytes")
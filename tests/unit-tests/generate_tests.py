@@ -6,6 +6,14 @@ import logging
 import os
 import shutil
 import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+# helmify's kustomization walker is imported from the repository root, so the
+# script can be run from any directory without setting PYTHONPATH.
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from tools.helmify.src.kustomization_inputs import kustomization_inputs
 
 # Search dirs should be directories to search for kustomization packages
 # that we want to test. These should be kustomization's that are doing
@@ -43,26 +51,42 @@ def generate_test_path(repo_root, kustomize_rpath):
 
 
 def run_kustomize_build(repo_root, package_dir):
-    """Run kustomize build and store the output in the test directory."""
+    """Run kustomize build and store the output in the test directory.
+
+    Builds of different packages can run concurrently, so nothing is logged
+    here. Returns whether the build succeeded and its log, which includes
+    kustomize's output.
+    """
 
     rpath = os.path.relpath(package_dir, repo_root)
 
     output_dir = os.path.join(
         repo_root, "tests/unit-tests", rpath, KUSTOMIZE_OUTPUT_DIR)
 
+    log = []
     if os.path.exists(output_dir):
         # Remove any previous version of the directory so that we ensure
         # that all files in that directory are from the new run
         # of kustomize build -o
-        logging.info("Removing directory %s", output_dir)
+        log.append("Removing directory %s" % output_dir)
         shutil.rmtree(output_dir)
 
-    logging.info("Creating directory %s", output_dir)
+    log.append("Creating directory %s" % output_dir)
     os.makedirs(output_dir)
 
-    subprocess.check_call([os.environ.get("KUSTOMIZE_BIN", "kustomize"), "build", "--load_restrictor", "none",
-                           "-o", output_dir], cwd=os.path.join(repo_root,
-                                                               package_dir))
+    result = subprocess.run([os.environ.get("KUSTOMIZE_BIN", "kustomize"), "build", "--load_restrictor", "none",
+                             "-o", output_dir], cwd=os.path.join(repo_root,
+                                                                 package_dir),
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    if result.stdout:
+        log.append(result.stdout.decode().rstrip("\n"))
+    if result.returncode != 0:
+        log.append("kustomize build exited with status %d" %
+                   result.returncode)
+        # Without expected output the package is rebuilt by the next
+        # generate-changed-only run.
+        shutil.rmtree(output_dir)
+    return result.returncode == 0, log
 
 
 def find_kustomize_dirs(search_dirs):
@@ -86,6 +110,46 @@ def find_kustomize_dirs(search_dirs):
     return changed_dirs
 
 
+def find_changed_files(repo_root, base_ref):
+    """Return the absolute paths of the files that differ from base_ref.
+
+    This includes committed and uncommitted changes, deleted files and
+    untracked files that are not ignored.
+    """
+    diff = subprocess.check_output(
+        ["git", "diff", "--name-only", base_ref], cwd=repo_root).decode()
+    untracked = subprocess.check_output(
+        ["git", "ls-files", "--others", "--exclude-standard"],
+        cwd=repo_root).decode()
+    return {os.path.join(repo_root, path)
+            for path in diff.splitlines() + untracked.splitlines()}
+
+
+def find_changed_dirs(repo_root, package_dirs, changed_files):
+    """Return the package directories whose expected output may have changed.
+
+    A package changed if any of its transitive inputs changed or if it has
+    no expected output yet.
+    """
+    inputs_by_dir = {}
+    changed_dirs = set()
+    for package_dir in package_dirs:
+        rpath = os.path.relpath(package_dir, repo_root)
+        output_dir = os.path.join(
+            repo_root, "tests/unit-tests", rpath, KUSTOMIZE_OUTPUT_DIR)
+        if not os.path.exists(output_dir):
+            logging.info("%s has no expected output", rpath)
+            changed_dirs.add(package_dir)
+            continue
+        changed_inputs = kustomization_inputs(package_dir, inputs_by_dir) & \
+            changed_files
+        if changed_inputs:
+            logging.info("%s changed: %s", rpath, ", ".join(sorted(
+                os.path.relpath(path, repo_root) for path in changed_inputs)))
+            changed_dirs.add(package_dir)
+    return changed_dirs
+
+
 def write_go_test(test_path, package_name, package_dir):
     """Write the go test file.
 
@@ -119,7 +183,20 @@ if __name__ == "__main__":
         "--all",
         dest="all_tests",
         action="store_true",
-        help="(Deprecated) this parameter has no effect")
+        help="Regenerate the tests of every package, not only changed ones")
+
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of kustomize builds to run in parallel, defaults to "
+             "the number of CPUs")
+
+    parser.add_argument(
+        "--base-ref",
+        default="HEAD",
+        help="Git ref to detect changed files against; by default only "
+             "uncommitted changes are detected")
 
     parser.set_defaults(all_tests=False)
 
@@ -133,7 +210,14 @@ if __name__ == "__main__":
     full_search_dirs = [os.path.join(repo_root, s) for s in SEARCH_DIRS]
     package_dirs = find_kustomize_dirs(full_search_dirs)
 
-    changed_dirs = package_dirs
+    if args.all_tests:
+        changed_dirs = package_dirs
+    else:
+        changed_files = find_changed_files(repo_root, args.base_ref)
+        changed_dirs = find_changed_dirs(repo_root, package_dirs,
+                                         changed_files)
+        logging.info("%d of %d packages changed since %s", len(changed_dirs),
+                     len(package_dirs), args.base_ref)
 
     this_dir = os.path.dirname(__file__)
     loader = jinja2.FileSystemLoader(searchpath=os.path.join(
@@ -141,16 +225,31 @@ if __name__ == "__main__":
     env = jinja2.Environment(loader=loader)
     template = env.get_template("kustomize_test.go.template")
 
-    for full_dir in changed_dirs:
+    changed_dirs = sorted(changed_dirs)
+
+    # Every build writes to its own expected output directory, so builds
+    # can run in parallel. kustomize does the work in its own process, so
+    # threads are enough to keep --jobs builds running.
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+        build_results = list(executor.map(
+            lambda full_dir: run_kustomize_build(repo_root, full_dir),
+            changed_dirs))
+
+    failed_dirs = []
+    # Logs are printed in package order, whichever build finished first.
+    for full_dir, (succeeded, build_log) in zip(changed_dirs, build_results):
         # Get the relative path of the kustomize directory.
         # This is the path relative to the repo root.
         rpath = os.path.relpath(full_dir, repo_root)
 
         test_path = generate_test_path(repo_root, rpath)
         logging.info("Regenerating test %s for %s ", test_path, full_dir)
+        for message in build_log:
+            logging.info("%s: %s", rpath, message)
 
-        # Generate the kustomize output
-        run_kustomize_build(repo_root, full_dir)
+        if not succeeded:
+            failed_dirs.append(rpath)
+            continue
 
         # Create the go test file.
         # TODO(jlewi): We really shouldn't need to redo this if it already
@@ -171,3 +270,9 @@ if __name__ == "__main__":
         package_dir = os.path.join(*p)
 
         write_go_test(test_path, package_name, package_dir)
+
+    if failed_dirs:
+        logging.error("kustomize build failed for %d of %d packages: %s",
+                      len(failed_dirs), len(changed_dirs),
+                      ", ".join(failed_dirs))
+        sys.exit(1)
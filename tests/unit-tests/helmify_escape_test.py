@@ -0,0 +1,89 @@
+"""Tests of how helmify escapes {{ and }} in kustomize output.
+
+Run from this directory with the repository root on PYTHONPATH, e.g.
+PYTHONPATH=../.. python -m unittest helmify_escape_test
+"""
+
+import os
+import re
+import unittest
+
+from tools.helmify.src.helm_escape import (
+    escape_helm_delimiters,
+    params_helm_actions,
+)
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+
+# The istio sidecar injector is a Go template of its own, full of
+# {{ .Values.* }} actions that are not helm's.
+ISTIO_INJECTOR_CHART_FILE = os.path.join(
+    REPO_ROOT, "charts", "common", "istio", "templates", "ConfigMap",
+    "istio-sidecar-injector-istio-system-ConfigMap.yaml")
+
+S3_PARAMS_TEMPLATE = os.path.join(
+    REPO_ROOT, "tools", "helmify", "template", "kubeflow-pipelines", "params",
+    "s3", "params.env")
+
+# helm renders a raw string action {{`text`}} as text.
+RAW_STRING = re.compile(r"\{\{`([^`]*)`\}\}")
+
+
+def render_raw_strings(text):
+    return RAW_STRING.sub(lambda match: match.group(1), text)
+
+
+class EscapeHelmDelimitersTest(unittest.TestCase):
+
+    def setUp(self):
+        # The chart file is escaped, rendering it gives back the ConfigMap
+        # kustomize builds from upstream.
+        with open(ISTIO_INJECTOR_CHART_FILE) as chart_file:
+            self.injector = render_raw_strings(chart_file.read())
+
+    def test_upstream_values_action_is_escaped(self):
+        escaped, count = escape_helm_delimiters(
+            "privileged: {{ .Values.global.proxy.privileged }}")
+        self.assertEqual(
+            escaped,
+            "privileged: {{`{{`}} .Values.global.proxy.privileged {{`}}`}}")
+        self.assertEqual(count, 2)
+
+    def test_istio_injector_renders_back_unchanged(self):
+        self.assertIn("{{ .Values.global.proxy.privileged }}", self.injector)
+        self.assertIn("{{ .Values.revision }}", self.injector)
+
+        escaped, count = escape_helm_delimiters(self.injector)
+
+        self.assertEqual(count, self.injector.count("{{") +
+                         self.injector.count("}}"))
+        self.assertEqual(render_raw_strings(escaped), self.injector)
+        # Nothing is left for helm to evaluate.
+        self.assertNotIn("{{", RAW_STRING.sub("", escaped))
+
+    def test_params_template_actions_are_kept(self):
+        helm_actions = params_helm_actions([S3_PARAMS_TEMPLATE])
+        self.assertIn("{{ .Values.s3.bucketName }}", helm_actions)
+
+        escaped, count = escape_helm_delimiters(
+            "bucketName={{ .Values.s3.bucketName }}\n"
+            "privileged: {{ .Values.global.proxy.privileged }}\n",
+            helm_actions)
+
+        self.assertEqual(
+            escaped,
+            "bucketName={{ .Values.s3.bucketName }}\n"
+            "privileged: {{`{{`}} .Values.global.proxy.privileged {{`}}`}}\n")
+        self.assertEqual(count, 2)
+
+    def test_folded_params_template_action_is_kept(self):
+        escaped, count = escape_helm_delimiters(
+            "bucketName={{ .Values.s3.bucketName\n  }}",
+            ["{{ .Values.s3.bucketName }}"])
+
+        self.assertEqual(escaped, "bucketName={{ .Values.s3.bucketName\n  }}")
+        self.assertEqual(count, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
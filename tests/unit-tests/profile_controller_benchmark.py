@@ -0,0 +1,325 @@
+"""Benchmark the KFP profile controller's sync webhook.
+
+Starts the server built by server_factory in
+awsconfigs/apps/pipeline/s3/sync.py, replays metacontroller sync payloads
+against it over keep-alive connections and reports latency percentiles,
+syncs/sec and peak RSS as JSON. The report can be compared against a stored
+baseline recorded with the same workload and Python version on the same
+machine.
+"""
+
+import argparse
+import http.client
+import importlib.util
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SYNC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..",
+                         "awsconfigs", "apps", "pipeline", "s3", "sync.py")
+
+# Report fields describing the workload and interpreter. Reports are only
+# comparable if all of them match.
+WORKLOAD_FIELDS = ("namespaces", "replay", "rounds", "concurrency",
+                   "controller_workers", "python_version")
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "profile_controller_benchmark_baseline.json")
+
+CONTROLLER_SETTINGS = {
+    "visualization_server_image": "gcr.io/ml-pipeline/visualization-server",
+    "visualization_server_tag": "2.0.0-alpha.5",
+    "frontend_image": "gcr.io/ml-pipeline/frontend",
+    "frontend_tag": "2.0.0-alpha.5",
+    "disable_istio_sidecar": False,
+    "minio_access_key": "bWluaW8=",
+    "minio_secret_key": "bWluaW8xMjM=",
+    "minio_service_region": "us-west-2",
+    "kfp_default_pipeline_root": "s3://kfp-artifacts/pipeline-root",
+}
+
+# Child types metacontroller sends for the profile controller's
+# CompositeController, in the "<Kind>.<apiVersion>" form it keys them by.
+CHILD_TYPES = [
+    "Secret.v1",
+    "ConfigMap.v1",
+    "Deployment.apps/v1",
+    "Service.v1",
+    "DestinationRule.networking.istio.io/v1alpha3",
+    "AuthorizationPolicy.security.istio.io/v1beta1",
+]
+
+
+def load_sync_module(path):
+    """Import sync.py from path; it is shipped as a ConfigMap, not a package."""
+    spec = importlib.util.spec_from_file_location("profile_controller_sync",
+                                                  path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def observed_child(child, index):
+    """Decorate a desired child with the metadata the API server adds.
+
+    managedFields are what make real payloads large, so every child gets a
+    plausible set of them.
+    """
+    child = json.loads(json.dumps(child))
+    metadata = child["metadata"]
+    metadata.update({
+        "uid": "00000000-0000-0000-0000-%012d" % index,
+        "resourceVersion": str(100000 + index),
+        "creationTimestamp": "2023-01-01T00:00:00Z",
+        "ownerReferences": [{
+            "apiVersion": "v1",
+            "kind": "Namespace",
+            "name": metadata["namespace"],
+            "controller": True,
+            "blockOwnerDeletion": True,
+        }],
+        "managedFields": [{
+            "manager": manager,
+            "operation": "Update",
+            "apiVersion": child["apiVersion"],
+            "time": "2023-01-01T00:00:00Z",
+            "fieldsType": "FieldsV1",
+            "fieldsV1": {"f:metadata": {"f:labels": {".": {}},
+                                        "f:ownerReferences": {".": {}}},
+                         "f:spec": {".": {}}},
+        } for manager in ("metacontroller", "kube-controller-manager")],
+    })
+    if child["kind"] == "Deployment":
+        child["status"] = {"replicas": 1, "readyReplicas": 1,
+                           "availableReplicas": 1, "observedGeneration": 1}
+    return child
+
+
+def synthesize_payloads(sync_module, namespaces):
+    """Yield a metacontroller sync payload for each of namespaces profiles.
+
+    Most namespaces are ready, every tenth is missing its children and every
+    twentieth does not have pipelines enabled, roughly matching a cluster
+    where some profiles are still being provisioned.
+    """
+    compiled_children = sync_module.compile_children(**CONTROLLER_SETTINGS)
+
+    for i in range(namespaces):
+        name = "profile-%05d" % i
+        parent = {
+            "apiVersion": "v1",
+            "kind": "Namespace",
+            "metadata": {
+                "name": name,
+                "uid": "11111111-0000-0000-0000-%012d" % i,
+                "resourceVersion": str(i + 1),
+                "labels": {
+                    "app.kubernetes.io/part-of": "kubeflow-profile",
+                    "katib.kubeflow.org/metrics-collector-injection": "enabled",
+                    "serving.kubeflow.org/inferenceservice": "enabled",
+                },
+                "annotations": {"owner": "user%d@example.com" % i},
+            },
+            "spec": {"finalizers": ["kubernetes"]},
+            "status": {"phase": "Active"},
+        }
+        if i % 20 != 0:
+            parent["metadata"]["labels"]["pipelines.kubeflow.org/enabled"] = "true"
+
+        children = {child_type: {} for child_type in CHILD_TYPES}
+        if i % 10 != 0:
+            desired = sync_module.render_namespace(compiled_children, parent)
+            for j, child in enumerate(desired):
+                child_type = "{}.{}".format(child["kind"], child["apiVersion"])
+                children[child_type][child["metadata"]["name"]] = \
+                    observed_child(child, i * 100 + j)
+        yield {"controller": {}, "parent": parent, "children": children}
+
+
+def load_payloads(path):
+    """Yield recorded sync payloads, one JSON document per line of path."""
+    with open(path) as payload_file:
+        for line in payload_file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_benchmark(sync_module, payloads, rounds, concurrency, controller_workers):
+    """Serve payloads rounds times over concurrency connections.
+
+    Returns a dict of latency percentiles in milliseconds, syncs/sec and the
+    process's peak RSS.
+    """
+    bodies = [json.dumps(payload).encode("utf-8") for payload in payloads]
+    server = sync_module.server_factory(controller_port=0,
+                                        controller_workers=controller_workers,
+                                        **CONTROLLER_SETTINGS)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    port = server.server_address[1]
+
+    def client(offset):
+        connection = http.client.HTTPConnection("127.0.0.1", port)
+        latencies = []
+        for i in range(offset, len(bodies) * rounds, concurrency):
+            start = time.perf_counter()
+            connection.request("POST", "/sync", body=bodies[i % len(bodies)],
+                               headers={"Content-Type": "application/json"})
+            response = connection.getresponse()
+            response.read()
+            latencies.append(time.perf_counter() - start)
+            if response.status != 200:
+                raise Exception("sync returned HTTP %d" % response.status)
+            if response.will_close:
+                connection.close()
+                connection = http.client.HTTPConnection("127.0.0.1", port)
+        connection.close()
+        return latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(client, range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    server.shutdown()
+    server.server_close()
+
+    latencies = sorted(latency for result in results for latency in result)
+    return {
+        "syncs": len(latencies),
+        "concurrency": concurrency,
+        "controller_workers": controller_workers,
+        "syncs_per_second": round(len(latencies) / elapsed, 1),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1000, 3),
+            "p95": round(percentile(latencies, 0.95) * 1000, 3),
+            "p99": round(percentile(latencies, 0.99) * 1000, 3),
+        },
+        # ru_maxrss is reported in kilobytes on Linux.
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+
+
+def workload_mismatches(report, baseline):
+    """Return the workload fields whose values differ between two reports."""
+    return ["%s is %s, baseline has %s" % (
+        field, json.dumps(report.get(field)), json.dumps(baseline.get(field)))
+        for field in WORKLOAD_FIELDS
+        if report.get(field) != baseline.get(field)]
+
+
+def compare_to_baseline(report, baseline, tolerance):
+    """Return a list of regressions of report against baseline.
+
+    Args:
+      report: Report produced by run_benchmark.
+      baseline: Previously stored report.
+      tolerance: Fraction by which a result may be worse than the baseline.
+    """
+    regressions = []
+    if report["syncs_per_second"] < baseline["syncs_per_second"] * (1 - tolerance):
+        regressions.append("syncs_per_second %s is below baseline %s" % (
+            report["syncs_per_second"], baseline["syncs_per_second"]))
+    # p99 is too noisy on shared CI machines to gate on.
+    for name in ("p50", "p95"):
+        if report["latency_ms"][name] > baseline["latency_ms"][name] * (1 + tolerance):
+            regressions.append("%s latency %sms is above baseline %sms" % (
+                name, report["latency_ms"][name], baseline["latency_ms"][name]))
+    if report["peak_rss_bytes"] > baseline["peak_rss_bytes"] * (1 + tolerance):
+        regressions.append("peak RSS %d bytes is above baseline %d bytes" % (
+            report["peak_rss_bytes"], baseline["peak_rss_bytes"]))
+    return regressions
+
+
+if __name__ == "__main__":
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format=('%(levelname)s|%(asctime)s'
+                '|%(pathname)s|%(lineno)d| %(message)s'),
+        datefmt='%Y-%m-%dT%H:%M:%S',
+    )
+    logging.getLogger().setLevel(logging.INFO)
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--namespaces", type=int, default=500,
+        help="Number of profile namespaces to synthesize payloads for")
+    parser.add_argument(
+        "--replay",
+        help="File of recorded sync payloads, one JSON document per line, "
+             "to use instead of synthesized ones")
+    parser.add_argument(
+        "--rounds", type=int, default=4,
+        help="Number of times every payload is synced")
+    parser.add_argument(
+        "--concurrency", type=int, default=8,
+        help="Number of concurrent keep-alive connections")
+    parser.add_argument(
+        "--controller-workers", type=int, default=8,
+        help="CONTROLLER_WORKERS setting of the server under test")
+    parser.add_argument(
+        "--sync-path", default=SYNC_PATH,
+        help="Path of the sync.py under test")
+    parser.add_argument(
+        "--output", help="Write the JSON report to this file")
+    parser.add_argument(
+        "--baseline", default=BASELINE_PATH,
+        help="Stored report to compare against")
+    parser.add_argument(
+        "--compare", action="store_true",
+        help="Exit nonzero if the report regresses against --baseline")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.5,
+        help="Fraction by which results may be worse than the baseline")
+
+    args = parser.parse_args()
+
+    sync_module = load_sync_module(args.sync_path)
+    # Logging every sync to the terminal would dominate the measurement.
+    sync_module.logger.setLevel(logging.WARNING)
+    if args.replay:
+        payloads = list(load_payloads(args.replay))
+    else:
+        payloads = list(synthesize_payloads(sync_module, args.namespaces))
+
+    report = run_benchmark(sync_module, payloads, args.rounds,
+                           args.concurrency, args.controller_workers)
+    report.update({
+        "namespaces": len(payloads),
+        "replay": args.replay and os.path.basename(args.replay),
+        "rounds": args.rounds,
+        "python_version": "%d.%d" % sys.version_info[:2],
+    })
+    report_json = json.dumps(report, indent=2, sort_keys=True)
+    print(report_json)
+
+    if args.output:
+        logging.info("Writing report to %s", args.output)
+        with open(args.output, "w") as output_file:
+            output_file.write(report_json + "\n")
+
+    if args.compare:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        mismatches = workload_mismatches(report, baseline)
+        for mismatch in mismatches:
+            logging.error("Not comparable with the baseline: %s", mismatch)
+        if mismatches:
+            sys.exit(2)
+        regressions = compare_to_baseline(report, baseline, args.tolerance)
+        for regression in regressions:
+            logging.error("Regression: %s", regression)
+        if regressions:
+            sys.exit(1)
@@ -1,7 +1,5 @@
 CONFIG_FILE = "./tools/helmify/src/config.yaml"
-KUSTOMIZED_BUILD_OUTPUT_PATH = (
-    "./tools/helmify/generated_output/kustomized_output_files"
-)
-HELM_TEMP_OUTPUT_PATH = "./tools/helmify/generated_output/helm_chart_temp_output_files"
-SPLITTED_OUTPUT_PATH = "./tools/helmify/generated_output/kustomized_output_files/splitted_output"
-POSSIBLE_PROBLEM_FILE_TYPES = ["ConfigMap", "ClusterServingRuntime"]
+KUSTOMIZE_CACHE_PATH = "./tools/helmify/generated_output/kustomize_cache"
+CHART_MANIFEST_PATH = "./tools/helmify/generated_output/chart_manifests"
+CHART_HELPERS_TEMPLATE_FILE = "./tools/helmify/template/chart_scaffold/_helpers.tpl"
+HELMIFY_REPORT_FILE = "./tools/helmify/generated_output/helmify_report.json"
@@ -0,0 +1,66 @@
+"""Escaping of the helm template delimiters in kustomize output.
+
+Only uses the standard library, so the unit tests can import it without
+helmify's other dependencies.
+"""
+
+import functools
+import re
+
+
+# Every {{ and }} in kustomize output is escaped so helm renders it as is,
+# except for the helm actions a component's params templates put there on
+# purpose, such as {{ .Values.s3.bucketName }}. Upstream manifests use Go
+# templates of their own, e.g. the istio sidecar injector's
+# {{ .Values.global.proxy.privileged }}, so only those exact actions are kept.
+HELM_ACTION = re.compile(r"\{\{.*?\}\}")
+ESCAPED_HELM_DELIMITERS = {"{{": "{{`{{`}}", "}}": "{{`}}`}}"}
+
+
+def params_helm_actions(template_paths: list):
+    """Returns the helm actions in a component's params templates, sorted."""
+    helm_actions = set()
+    for template_path in template_paths or []:
+        with open(template_path, "r") as file:
+            helm_actions.update(HELM_ACTION.findall(file.read()))
+    return sorted(helm_actions)
+
+
+@functools.lru_cache(maxsize=None)
+def helm_delimiters(helm_actions: tuple):
+    """Returns a pattern matching helm_actions, or else a single {{ or }}.
+
+    yaml.dump may fold long strings, so the actions match across any
+    whitespace between their words.
+    """
+    patterns = [
+        r"\s+".join(re.escape(word) for word in helm_action.split())
+        for helm_action in sorted(helm_actions, key=len, reverse=True)
+    ]
+    return re.compile("|".join(patterns + [r"\{\{", r"\}\}"]))
+
+
+def escape_helm_delimiters(text: str, helm_actions=()):
+    """Returns text with every {{ and }} escaped, except in helm_actions.
+
+    The text is scanned once, so keys and values of every node type are
+    covered. Each delimiter is escaped on its own, which stays valid when
+    delimiters are unbalanced or backticks are used in between.
+
+    Args:
+      text: Text of a kustomize object.
+      helm_actions: Helm actions to keep, see params_helm_actions.
+
+    Returns the escaped text and the number of delimiters escaped.
+    """
+    escaped = 0
+
+    def replace(match):
+        nonlocal escaped
+        delimiter = match.group(0)
+        if delimiter in ESCAPED_HELM_DELIMITERS:
+            escaped += 1
+            return ESCAPED_HELM_DELIMITERS[delimiter]
+        return delimiter
+
+    return helm_delimiters(tuple(helm_actions)).sub(replace, text), escaped
@@ -0,0 +1,117 @@
+"""The local files a kustomize build reads.
+
+helmify hashes them to cache kustomize builds, and the unit test generator
+in tests/unit-tests rebuilds the expected output of packages whose inputs
+changed. Both only depend on yaml, so this module must not import anything
+else.
+"""
+
+import os
+
+import yaml
+
+KUSTOMIZATION_FILE_NAMES = ["kustomization.yaml", "kustomization.yml", "Kustomization"]
+
+# Fields of a kustomization listing files or kustomization directories.
+PATH_LIST_FIELDS = [
+    "resources",
+    "bases",
+    "components",
+    "crds",
+    "configurations",
+    "generators",
+    "transformers",
+    "validators",
+    "patchesStrategicMerge",
+]
+
+# Fields of a kustomization listing objects with a path to a file.
+PATH_OBJECT_FIELDS = ["patches", "patchesJson6902", "replacements"]
+
+# Fields of configMapGenerator and secretGenerator entries listing files.
+GENERATOR_FILE_FIELDS = ["files", "envs"]
+
+
+def kustomization_file(kustomization_dir: str):
+    """Returns the kustomization file of kustomization_dir, or None if it has none."""
+    for file_name in KUSTOMIZATION_FILE_NAMES:
+        path = os.path.join(kustomization_dir, file_name)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def kustomization_references(kustomization: dict):
+    """Yields the paths a loaded kustomization refers to, as written in it."""
+    for field in PATH_LIST_FIELDS:
+        for value in kustomization.get(field) or []:
+            # patchesStrategicMerge entries can be inline patches
+            if isinstance(value, str) and "\n" not in value:
+                yield value
+    for field in PATH_OBJECT_FIELDS:
+        for value in kustomization.get(field) or []:
+            if isinstance(value, dict) and value.get("path"):
+                yield value["path"]
+    for field in ["configMapGenerator", "secretGenerator"]:
+        for generator in kustomization.get(field) or []:
+            paths = []
+            for generator_field in GENERATOR_FILE_FIELDS:
+                paths.extend(generator.get(generator_field) or [])
+            if generator.get("env"):
+                paths.append(generator["env"])
+            for path in paths:
+                # files can be given a key, e.g. "config.json=path/to/file"
+                yield path.split("=", 1)[-1]
+    openapi = kustomization.get("openapi") or {}
+    if openapi.get("path"):
+        yield openapi["path"]
+
+
+def is_remote(reference: str):
+    return (
+        "://" in reference
+        or reference.startswith(("github.com/", "git@"))
+        or "?ref=" in reference
+    )
+
+
+def kustomization_inputs(kustomization_dir: str, inputs_by_dir: dict):
+    """Returns the local files a kustomize build of kustomization_dir may read.
+
+    These are the files of the kustomization directory and, transitively,
+    the files and kustomization directories its resources, bases,
+    components, patches and generators refer to. Every file of a visited
+    directory is included, so files read through fields not listed here are
+    covered when they sit next to the kustomization. Referenced files are
+    included even if they are missing, since deleting one changes the build.
+    Remote references are ignored.
+
+    Paths are normalized, and relative if kustomization_dir is relative.
+    inputs_by_dir holds the inputs of the directories visited so far and can
+    be shared between calls, so every directory is only read once.
+    """
+    kustomization_dir = os.path.normpath(kustomization_dir)
+    if kustomization_dir in inputs_by_dir:
+        return inputs_by_dir[kustomization_dir]
+    inputs = set()
+    # guards against cycles while the directory is being visited
+    inputs_by_dir[kustomization_dir] = inputs
+
+    path = kustomization_file(kustomization_dir)
+    if path is None:
+        return inputs
+    for entry in os.scandir(kustomization_dir):
+        if entry.is_file():
+            inputs.add(os.path.normpath(entry.path))
+    with open(path, "r") as file:
+        kustomization = yaml.safe_load(file) or {}
+
+    for reference in kustomization_references(kustomization):
+        if is_remote(reference):
+            continue
+        reference_path = os.path.normpath(os.path.join(kustomization_dir, reference))
+        if os.path.isdir(reference_path):
+            inputs.update(kustomization_inputs(reference_path, inputs_by_dir))
+        else:
+            inputs.add(reference_path)
+    return inputs
@@ -1,19 +1,26 @@
+import argparse
+import hashlib
+import json
 import logging
 
 import os
+import resource
 import shutil
-from numpy import character
+import subprocess
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
 
 import yaml
 from tests.e2e.utils.utils import (
     print_banner,
     load_yaml_file,
-    load_multiple_yaml_files,
-    write_yaml_file,
-    exec_shell,
 )
 
 from tools.helmify.src import common
+from tools.helmify.src.helm_escape import escape_helm_delimiters, params_helm_actions
+from tools.helmify.src.kustomization_inputs import kustomization_inputs
 
 
 logging.basicConfig(level=logging.INFO)
@@ -52,230 +59,262 @@ Components = [
 ]
 
 
-def kustomize_build(
-    kustomized_paths: list, helm_chart_name: str, kustomized_output_files_dir: str
-):
-    kustomized_file_list = []
-
-    if os.path.isdir(kustomized_output_files_dir) == False:
-        exec_shell(f"mkdir -p {kustomized_output_files_dir}")
-    for i in range(len(kustomized_paths)):
-        kustomized_path = kustomized_paths[i]
-        kustomized_file_name = f"{helm_chart_name}-kustomized-{i}.yaml"
-        exec_shell(
-            f"kustomize build {kustomized_path} > {kustomized_output_files_dir}/{kustomized_file_name}"
-        )
-        logger.info(
-            f"kustomize build completed, file is saved in '{kustomized_output_files_dir}/{kustomized_file_name}'"
-        )
-        if not os.path.isfile(f"{kustomized_output_files_dir}/{kustomized_file_name}"):
-            raise Exception("kustomized yaml file is not generated.")
-        kustomized_file_list.append(kustomized_file_name)
-    return kustomized_file_list
-
-
-def split_yaml(
-    kustomized_file_list: list,
-    splitted_output_path: str,
-    kustomized_output_files_dir: str,
-):
-    if os.path.isdir(splitted_output_path) == False:
-        logger.info(
-            f"creating temporary output folder to store splitted yaml files: '{splitted_output_path}'"
-        )
-        exec_shell(f"mkdir -p {splitted_output_path}")
-
-    for kustomized_file_name in kustomized_file_list:
-        kind_set = set()
-        content = load_multiple_yaml_files(
-            f"{kustomized_output_files_dir}/{kustomized_file_name}"
-        )
-        for data in content:
-            kind = data["kind"]
-            if kind not in kind_set:
-                kind_set.add(kind)
-                if kind == "CustomResourceDefinition":
-                    output_dir = f"{splitted_output_path}/crds"
-                else:
-                    output_dir = f"{splitted_output_path}/templates/{kind}"
-
-                if os.path.isdir(output_dir) == False:
-                    exec_shell(f"mkdir -p {output_dir}")
-            if "namespace" in data["metadata"]:
-                namespace = data["metadata"]["namespace"]
-                name = data["metadata"]["name"]
-                output_file_name = f"{name}-{namespace}-{kind}"
-            else:
-                name = data["metadata"]["name"]
-                output_file_name = f"{name}-{kind}"
-
-            # write file into outputFile
-            write_yaml_file(
-                yaml_content=data, file_path=f"{output_dir}/{output_file_name}.yaml"
-            )
-
-        logger.info(f"finished splitting!")
-
-
-def create_helm_chart(helm_chart_path: str, helm_chart_name: str, root_dir: str):
-    # if helm chart has been created already, return
-    if os.path.exists(f"{helm_chart_path}/Chart.yaml"):
-        shutil.rmtree(helm_chart_path)
-        
-
-    # make directory for helm chart location if it doesn't exist
-    if os.path.isdir(f"{helm_chart_path}") == False:
-        exec_shell(f"mkdir -p {helm_chart_path}")
-    os.chdir(helm_chart_path)
-    exec_shell(f"helm create {helm_chart_name}")
-    clean_up_redundant_helm_chart_contents(helm_chart_name)
-
-    # Move chart contents a folder level up for multiple deployment options charts
-    # example: kubeflowpipelines/vanilla/kubeflowpipelines -> kubeflowpipelines/vanilla
-
-    source = f"{helm_chart_name}"
-    dest = f"./"
-    file_list = os.listdir(source)
-    for file in file_list:
-        shutil.move(f"{source}/{file}", dest)
-    # delete folder
-    shutil.rmtree(source)
-
-    os.chdir(root_dir)
-
-
-def clean_up_redundant_helm_chart_contents(helm_chart_name):
-    # cleaning up template folder
-    logger.info(f"cleaning up redundant default helm files.")
-    dir = f"{helm_chart_name}/templates"
-    shutil.rmtree(f"{dir}/tests")
-    # delete all autogenerate yaml folders
-    filelist = os.listdir(dir)
-    for file in filelist:
-        if file.endswith(".yaml"):
-            os.remove(os.path.join(dir, file))
-    # delete NOTES.txt
-    os.remove(f"{dir}/NOTES.txt")
-    # delete .helmignore
-    os.remove(f"{helm_chart_name}/.helmignore")
-    logger.info(f"empty out value.yaml file.")
-    # empty values.yaml
-    value_file = f"{helm_chart_name}/values.yaml"
-    empty_yaml_file = None
-    write_yaml_file(yaml_content=empty_yaml_file, file_path=value_file)
-
-
-def move_generated_helm_files_to_folder(dest_dir: str, source_dir: str):
-    # move crds
-    if os.path.isdir(f"{source_dir}/crds"):
-        if os.path.isdir(f"{dest_dir}/crds") == False:
-            exec_shell(f"mkdir -p {dest_dir}/crds")
-        move_crd_files(dest_dir, f"{source_dir}/crds")
-
-    # move rest of kinds
-    move_non_crd_files(f"{dest_dir}/templates", f"{source_dir}/templates")
-
-
-def move_crd_files(dest_dir: str, source_dir: str):
-    filelist = os.listdir(source_dir)
-    for file in filelist:
-        crd_dest_path = f"{dest_dir}/crds"
-        shutil.move(f"{source_dir}/{file}", f"{crd_dest_path}/{file}")
-
-    logger.info(
-        f"completed moving Custom Resource Definition yaml files into crds folder."
+def get_kustomize_version():
+    completedProcess = subprocess.run(
+        "kustomize version", shell=True, capture_output=True, text=True
     )
-
-
-def move_non_crd_files(dest_dir: str, source_dir: str):
-    obj = os.scandir(source_dir)
-    logger.info(f"moving the rest of the kinds yaml files into helm templates folder.")
-    for entry in obj:
-        if entry.is_dir() or entry.is_file():
-            # move files to template
-            # make new kind folder
-            if os.path.isdir(f"{dest_dir}/{entry.name}") == False:
-                exec_shell(f"mkdir -p {dest_dir}/{entry.name}")
-            filelist = os.listdir(f"{source_dir}/{entry.name}")
-            for file in filelist:
-                if file.endswith(".yaml"):
-                    source = f"{source_dir}/{entry.name}/{file}"
-                    dest = f"{dest_dir}/{entry.name}/{file}"
-                    shutil.move(source, dest)
-    logger.info(
-        f"completed moving the rest of the kinds yaml files into helm templates folder."
+    if completedProcess.returncode != 0:
+        raise Exception("ERROR: Failed to get kustomize version")
+    return completedProcess.stdout.strip()
+
+
+def kustomize_build_cache_key(kustomized_path: str, kustomize_version: str):
+    """Returns the hash of everything the kustomize build of kustomized_path reads."""
+    input_files = kustomization_inputs(kustomized_path, {})
+    sha = hashlib.sha256()
+    sha.update(kustomize_version.encode("utf-8"))
+    sha.update(b"\0" + os.path.normpath(kustomized_path).encode("utf-8"))
+    for input_file in sorted(input_files):
+        sha.update(b"\0" + input_file.encode("utf-8") + b"\0")
+        # a missing file only contributes its path, the build fails on it
+        if os.path.isfile(input_file):
+            with open(input_file, "rb") as file:
+                sha.update(file.read())
+    return sha.hexdigest()
+
+
+def helm_chart_cache_key(build_cache_keys: list, chart_config: dict):
+    """Returns the hash of the kustomize builds, chart config and tool a chart is generated from."""
+    sha = hashlib.sha256()
+    sha.update(json.dumps([build_cache_keys, chart_config], sort_keys=True).encode("utf-8"))
+    tool_files = [__file__, common.__file__, common.CHART_HELPERS_TEMPLATE_FILE] + (
+        chart_config["values_template_paths"] or []
     )
+    for tool_file in tool_files:
+        with open(tool_file, "rb") as file:
+            sha.update(file.read())
+    return sha.hexdigest()
+
+
+def helm_chart_cache_record(output_helm_chart_path: str):
+    chart_id = hashlib.sha256(
+        os.path.normpath(output_helm_chart_path).encode("utf-8")
+    ).hexdigest()
+    return f"{common.KUSTOMIZE_CACHE_PATH}/charts/{chart_id}"
+
+
+def is_helm_chart_cached(output_helm_chart_path: str, chart_cache_key: str):
+    """Returns whether the chart was generated from chart_cache_key and is unmodified.
+
+    Every file recorded in the chart's manifest must still have the sha256
+    recorded there, so charts edited or partly deleted since are regenerated.
+    """
+    record = helm_chart_cache_record(output_helm_chart_path)
+    manifest_path = helm_chart_manifest_path(output_helm_chart_path)
+    if not os.path.isfile(record) or not os.path.isfile(manifest_path):
+        return False
+    with open(record, "r") as file:
+        if file.read() != chart_cache_key:
+            return False
+    manifest = load_yaml_file(file_path=manifest_path)
+    if not manifest:
+        return False
+    for path, digest in manifest.items():
+        file_path = f"{output_helm_chart_path}/{path}"
+        if not os.path.isfile(file_path):
+            return False
+        with open(file_path, "rb") as file:
+            if hashlib.sha256(file.read()).hexdigest() != digest:
+                return False
+    return True
+
+
+def write_cache_file(cache_file_path: str, content: str):
+    # written to a temporary file first, parallel jobs may share cache entries
+    os.makedirs(os.path.dirname(cache_file_path), exist_ok=True)
+    temp_file_path = f"{cache_file_path}.{os.getpid()}.tmp"
+    with open(temp_file_path, "w") as file:
+        file.write(content)
+    os.replace(temp_file_path, cache_file_path)
+
+
+class TeeReader:
+    """File-like reader that copies everything read from source to copy."""
+
+    def __init__(self, source, copy):
+        self.source = source
+        self.copy = copy
+
+    def read(self, size=-1):
+        data = self.source.read(size)
+        self.copy.write(data)
+        return data
+
+
+def kustomize_build_documents(kustomized_path: str, cached_file_path=None):
+    """Yields the objects kustomize builds from kustomized_path as they are parsed.
+
+    kustomize's output is parsed while it is being written, without storing
+    it first. With a cached_file_path, the output is read from that file if
+    it exists, otherwise it is also written to it.
+    """
+    if cached_file_path and os.path.isfile(cached_file_path):
+        logger.info(f"kustomize build of '{kustomized_path}' is unchanged, reading cached output")
+        with open(cached_file_path, "r") as file:
+            yield from yaml.safe_load_all(file)
+        return
+
+    cmd = f"kustomize build {kustomized_path}"
+    process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, text=True)
+    cache_file = None
+    try:
+        stream = process.stdout
+        if cached_file_path:
+            os.makedirs(os.path.dirname(cached_file_path), exist_ok=True)
+            temp_file_path = f"{cached_file_path}.{os.getpid()}.tmp"
+            cache_file = open(temp_file_path, "w")
+            stream = TeeReader(process.stdout, cache_file)
+        yield from yaml.safe_load_all(stream)
+        process.stdout.close()
+        if process.wait() != 0:
+            raise Exception(f"ERROR: Failed to execute shell command \n{cmd}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        if cache_file:
+            cache_file.close()
+            if process.returncode == 0:
+                os.replace(temp_file_path, cached_file_path)
+            else:
+                os.remove(temp_file_path)
+    logger.info(f"kustomize build of '{kustomized_path}' completed")
 
 
-def find_potential_failed_yaml_files(
-    helm_temp_dir: str, possible_problem_file_types: list
-):
-
-    problem_filelist = []
-    problem_filelist_output_paths = []
-
-    for file_type in possible_problem_file_types:
-        if os.path.isdir(f"{helm_temp_dir}/templates/{file_type}"):
-            logger.info(
-                f"finding potential problematic yaml files in {file_type} folder."
-            )
-            filelist = os.listdir(f"{helm_temp_dir}/templates/{file_type}")
-            for file in filelist:
-                content = load_multiple_yaml_files(
-                    file_path=f"{helm_temp_dir}/templates/{file_type}/{file}"
-                )
-                for elem in content:
-                    find_potential_failed_files_recursive_lookup(
-                        elem, problem_filelist, file
-                    )
-
-            if problem_filelist:
-                if (
-                    os.path.isdir(
-                        f"{helm_temp_dir}/potential_failed_helm_conversions/{file_type}"
-                    )
-                    == False
-                ):
-                    exec_shell(
-                        f"mkdir -p {helm_temp_dir}/potential_failed_helm_conversions/{file_type}"
-                    )
-                logger.info(
-                    f"Some Yaml files in {file_type} folder are conflicted with helm template formatting. Please check on files inside failed_helm_conversions folder. Replace all backticks with double quotes, then all {{ with {{`{{ and all }} with }}`}}"
-                )
-                for file in problem_filelist:
-                    source = f"{helm_temp_dir}/templates/{file_type}/{file}"
-                    dest = f"{helm_temp_dir}/potential_failed_helm_conversions/{file_type}/{file}"
-                    shutil.move(source, dest)
-                    problem_filelist_output_paths.append(dest)
-                    problem_filelist.remove(file)
-    return problem_filelist_output_paths
-
-
-def find_potential_failed_files_recursive_lookup(
-    dictionaries: dict, problem_filelist: list, file: yaml
-):
-    for k, v in dictionaries.items():
-        if isinstance(v, dict):
-            find_potential_failed_files_recursive_lookup(v, problem_filelist, file)
-        else:
-            flag = search(v, "{{") or search(v, "}}")
-            if flag:
-                problem_filelist.append(file)
+def helm_chart_object_path(data: dict):
+    """Returns the folder and file name of an object relative to its chart."""
+    kind = data["kind"]
+    if kind == "CustomResourceDefinition":
+        output_dir = "crds"
+    else:
+        output_dir = f"templates/{kind}"
+    if "namespace" in data["metadata"]:
+        namespace = data["metadata"]["namespace"]
+        name = data["metadata"]["name"]
+        output_file_name = f"{name}-{namespace}-{kind}"
+    else:
+        name = data["metadata"]["name"]
+        output_file_name = f"{name}-{kind}"
+    return output_dir, f"{output_file_name}.yaml"
+
+
+def helm_chart_scaffold_files(helm_chart_name: str, version: str, app_version: str):
+    """Returns the files of an empty helm chart by path relative to the chart.
+
+    These are the files helm create generates that helmify keeps: Chart.yaml
+    with the chart's versions, an empty values.yaml and the chart's
+    _helpers.tpl.
+    """
+    chart_info = {
+        "apiVersion": "v2",
+        "name": helm_chart_name,
+        "description": "A Helm chart for Kubernetes",
+        "type": "application",
+        "version": version,
+        "appVersion": app_version,
+    }
+    with open(common.CHART_HELPERS_TEMPLATE_FILE, "r") as file:
+        helpers = file.read().replace("<CHARTNAME>", helm_chart_name)
+    return {
+        "Chart.yaml": yaml.dump(chart_info),
+        "values.yaml": yaml.dump(None),
+        "templates/_helpers.tpl": helpers,
+    }
+
+
+def helm_chart_manifest_path(output_helm_chart_path: str):
+    chart_id = os.path.normpath(output_helm_chart_path).replace("/", "-")
+    return f"{common.CHART_MANIFEST_PATH}/{chart_id}.json"
+
+
+def write_helm_chart(output_helm_chart_path: str, files: dict):
+    """Writes the files of a chart, only rewriting files whose content changed.
+
+    Files recorded in the previous manifest that are no longer generated are
+    deleted, other files in the chart folder are left alone. The manifest of
+    the chart, the sha256 of every file by relative path, is written to
+    common.CHART_MANIFEST_PATH.
+
+    Returns the number of files written, unchanged and deleted, and the
+    number of bytes written.
+    """
+    manifest_path = helm_chart_manifest_path(output_helm_chart_path)
+    previous_paths = set()
+    if os.path.isfile(manifest_path):
+        previous_paths.update(load_yaml_file(file_path=manifest_path) or {})
+
+    manifest = {}
+    written = 0
+    written_bytes = 0
+    for path in sorted(files):
+        content = files[path].encode("utf-8")
+        manifest[path] = hashlib.sha256(content).hexdigest()
+        file_path = f"{output_helm_chart_path}/{path}"
+        if os.path.isfile(file_path):
+            with open(file_path, "rb") as file:
+                if file.read() == content:
+                    continue
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as file:
+            file.write(content)
+        written += 1
+        written_bytes += len(content)
+
+    stale_paths = sorted(previous_paths - set(files))
+    for path in stale_paths:
+        file_path = f"{output_helm_chart_path}/{path}"
+        if os.path.isfile(file_path):
+            os.remove(file_path)
+        # remove folders left empty, up to the chart folder
+        folder_path = os.path.dirname(file_path)
+        while (
+            os.path.normpath(folder_path) != os.path.normpath(output_helm_chart_path)
+            and os.path.isdir(folder_path)
+            and not os.listdir(folder_path)
+        ):
+            os.rmdir(folder_path)
+            folder_path = os.path.dirname(folder_path)
+
+    write_cache_file(manifest_path, json.dumps(manifest, indent=2, sort_keys=True) + "\n")
+    return written, len(files) - written, len(stale_paths), written_bytes
+
+
+class PhaseTimer:
+    """Adds up the wall time spent in each phase of a helmify run, by name."""
+
+    def __init__(self):
+        self.phases = {}
+
+    def add(self, name: str, start: float):
+        self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def timed(self, name: str, iterable):
+        """Yields from iterable, timing how long each item takes to produce."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(name, start)
                 return
+            self.add(name, start)
+            yield item
 
 
-def search(value: str, search_for: character):
-    n = len(value)
-    for i in range(0, n - 1):
-        if search_for[0] == value[i] and search_for[1] == value[i + 1]:
-            return True
-    return False
-
-
-def clean_up_folder(folder_path: str):
-    logger.info(f"deleting folder: {folder_path}")
-    shutil.rmtree(f"{folder_path}")
-    logger.info("folder deleted.")
+def peak_rss_bytes(who=resource.RUSAGE_SELF):
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(who).ru_maxrss * 1024
 
 
 def copy_template_files_to_target_files(template_paths: list, target_paths: list):
@@ -289,162 +328,328 @@ def generate_helm_chart(
     output_helm_chart_path: str,
     version: str,
     app_version: str,
-    kustomize_build_output_path: str,
-    helm_temp_output_path: str,
-    possible_problem_file_types: list,
-    root_dir: str,
-    potential_failed_components: set,
-    params_template_paths=None,
-    params_target_paths=None,
     values_template_paths=None,
     values_target_paths=None,
     deployment_option=None,
+    kustomize_version=None,
+    helm_actions=(),
 ):
+    """Generates the helm chart of one component or deployment option.
+
+    Returns the paths of the files helm delimiters were escaped in, whether
+    the chart was unchanged and the chart's stats: the wall time of each
+    phase, the number of objects and the bytes written. With a kustomize_version, charts whose kustomization inputs,
+    config and values templates did not change since they were last
+    generated are skipped, and unchanged kustomize builds are reused.
+    """
+    timer = PhaseTimer()
+    stats = {
+        "chart": output_helm_chart_path,
+        "component": helm_chart_name,
+        "deployment_option": deployment_option,
+        "phases": timer.phases,
+        "objects": 0,
+        "files_written": 0,
+        "bytes_written": 0,
+    }
     print_banner(f"==========Converting '{helm_chart_name}'==========")
     if deployment_option:
         print(f"Deployment Option: {deployment_option}")
-        kustomized_output_files_dir = (
-            f"{kustomize_build_output_path}/{helm_chart_name}/{deployment_option}"
-        )
-        splitted_output_path = f"{kustomize_build_output_path}/splitted_output/{helm_chart_name}/{deployment_option}"
-        helm_temp_dir = f"{helm_temp_output_path}/{helm_chart_name}/{deployment_option}"
-    else:
-        kustomized_output_files_dir = f"{kustomize_build_output_path}/{helm_chart_name}"
-        splitted_output_path = (
-            f"{kustomize_build_output_path}/splitted_output/{helm_chart_name}"
-        )
-        helm_temp_dir = f"{helm_temp_output_path}/{helm_chart_name}"
 
-    if params_template_paths:
-        copy_template_files_to_target_files(params_template_paths, params_target_paths)
+    build_cache_keys = None
+    chart_cache_key = None
+    if kustomize_version:
+        start = time.perf_counter()
+        build_cache_keys = [
+            kustomize_build_cache_key(kustomize_path, kustomize_version)
+            for kustomize_path in kustomize_paths
+        ]
+        chart_cache_key = helm_chart_cache_key(
+            build_cache_keys,
+            {
+                "helm_chart_name": helm_chart_name,
+                "output_helm_chart_path": output_helm_chart_path,
+                "version": version,
+                "app_version": app_version,
+                "deployment_option": deployment_option,
+                "values_template_paths": values_template_paths,
+                "values_target_paths": values_target_paths,
+            },
+        )
+        cache_hit = is_helm_chart_cached(output_helm_chart_path, chart_cache_key)
+        timer.add("cache_check", start)
+        if cache_hit:
+            print(f"'{output_helm_chart_path}' is unchanged, skipping")
+            return [], True, stats
+        # the chart is about to change, forget what it was generated from
+        if os.path.isfile(helm_chart_cache_record(output_helm_chart_path)):
+            os.remove(helm_chart_cache_record(output_helm_chart_path))
 
-    kustomized_file_list = kustomize_build(
-        kustomize_paths, helm_chart_name, kustomized_output_files_dir
-    )
-    split_yaml(kustomized_file_list, splitted_output_path, kustomized_output_files_dir)
     print("Creating Helm Chart Based On Kustomize Build Output")
-    create_helm_chart(output_helm_chart_path, helm_chart_name, root_dir)
-    update_helm_chart_versions(output_helm_chart_path, version, app_version)
-    if values_template_paths:
-        copy_template_files_to_target_files(values_template_paths, values_target_paths)
-
-    move_generated_helm_files_to_folder(helm_temp_dir, splitted_output_path)
-    failed_filelist = find_potential_failed_yaml_files(
-        helm_temp_dir, possible_problem_file_types
-    )
-    clean_up_folder(splitted_output_path)
-
-    if len(failed_filelist) == 0:
-        move_generated_helm_files_to_folder(output_helm_chart_path, helm_temp_dir)
-        clean_up_folder(helm_temp_dir)
-    else:
-        potential_failed_components.add(helm_chart_name)
-    return potential_failed_components
-
+    # the chart is put together in memory, by path relative to the chart
+    # folder, and only written once it is complete
+    start = time.perf_counter()
+    files = helm_chart_scaffold_files(helm_chart_name, version, app_version)
+    for template_path, target_path in zip(
+        values_template_paths or [], values_target_paths or []
+    ):
+        with open(template_path, "r") as file:
+            files[os.path.relpath(target_path, output_helm_chart_path)] = file.read()
+    timer.add("scaffold", start)
+
+    escaped_file_paths = []
+    for i in range(len(kustomize_paths)):
+        cached_file_path = None
+        if build_cache_keys:
+            cached_file_path = (
+                f"{common.KUSTOMIZE_CACHE_PATH}/builds/{build_cache_keys[i]}.yaml"
+            )
+        # kustomize_build is the time spent waiting for kustomize's next
+        # object, render the time spent converting it to a template
+        for data in timer.timed(
+            "kustomize_build",
+            kustomize_build_documents(kustomize_paths[i], cached_file_path),
+        ):
+            if data is None:
+                continue
+            start = time.perf_counter()
+            stats["objects"] += 1
+            output_dir, output_file_name = helm_chart_object_path(data)
+            path = f"{output_dir}/{output_file_name}"
+            files[path], escaped = escape_helm_delimiters(
+                yaml.dump(data), helm_actions
+            )
+            if escaped:
+                logger.info(
+                    f"escaped {escaped} helm template delimiters in '{output_helm_chart_path}/{path}'"
+                )
+                escaped_file_paths.append(f"{output_helm_chart_path}/{path}")
+            timer.add("render", start)
 
-def update_helm_chart_versions(
-    output_helm_chart_path: str, version: str, app_version: str
-):
-    chart_info = load_yaml_file(file_path=f"{output_helm_chart_path}/Chart.yaml")
-    chart_info["version"] = version
-    chart_info["appVersion"] = app_version
-    write_yaml_file(
-        yaml_content=chart_info, file_path=f"{output_helm_chart_path}/Chart.yaml"
+    start = time.perf_counter()
+    written, unchanged, deleted, written_bytes = write_helm_chart(
+        output_helm_chart_path, files
+    )
+    timer.add("write_chart", start)
+    stats["files_written"] = written
+    stats["bytes_written"] = written_bytes
+    logger.info(
+        f"finished writing '{output_helm_chart_path}': {written} files written, {unchanged} unchanged, {deleted} deleted"
     )
 
+    if chart_cache_key:
+        write_cache_file(
+            helm_chart_cache_record(output_helm_chart_path), chart_cache_key
+        )
+    return escaped_file_paths, False, stats
 
-def main():
-    root_dir = os.getcwd()
-    config_file_path = common.CONFIG_FILE
-    kustomize_build_output_path = common.KUSTOMIZED_BUILD_OUTPUT_PATH
-    helm_temp_output_path = common.HELM_TEMP_OUTPUT_PATH
-    possible_problem_file_types = common.POSSIBLE_PROBLEM_FILE_TYPES
-    splitted_output_path = common.SPLITTED_OUTPUT_PATH
-    potential_failed_components = set()
-    #create folders for temp output
-    
-    if os.path.isdir(helm_temp_output_path) == False:
-        exec_shell(f"mkdir -p {helm_temp_output_path}")
-    if os.path.isdir(splitted_output_path) == False:
-        exec_shell(f"mkdir -p {splitted_output_path}")
 
+def helm_chart_jobs(cfg: dict):
+    """Returns generate_helm_chart arguments for every chart, in Components order.
 
-    print_banner("Reading Config")
-    cfg = load_yaml_file(file_path=config_file_path)
+    Args:
+      cfg: Component config dictionary loaded from config.yaml.
+    """
+    jobs = []
     for component in Components:
-        helm_chart_name = component
-
-        params_template_paths = None
-        params_target_paths = None
         values_template_paths = None
         values_target_paths = None
-        deployment_option = None
+        helm_actions = []
 
-        ##component needs to configure env files and values file
+        ##component needs to configure values file
         if "params" in cfg[component]:
-            params_template_paths = cfg[component]["params"]["template_paths"]
-            params_target_paths = cfg[component]["params"]["target_paths"]
+            helm_actions = params_helm_actions(cfg[component]["params"]["template_paths"])
             values_template_paths = cfg[component]["values"]["template_paths"]
             values_target_paths = cfg[component]["values"]["target_paths"]
 
         if "deployment_options" in cfg[component]:
-            for deployment_option in cfg[component]["deployment_options"].keys():
-                    component_deployment_option = cfg[component]["deployment_options"][
-                        deployment_option
-                    ]
-                    kustomize_paths = component_deployment_option["kustomization_paths"]
-                    output_helm_chart_path = component_deployment_option[
-                        "output_helm_chart_path"
-                    ]
-                    version = component_deployment_option["version"]
-                    app_version = component_deployment_option["app_version"]
-                    #multiple deployment_options, run generate helm chart for each option
-                    potential_failed_components = generate_helm_chart(
-                        kustomize_paths,
-                        helm_chart_name,
-                        output_helm_chart_path,
-                        version,
-                        app_version,
-                        kustomize_build_output_path,
-                        helm_temp_output_path,
-                        possible_problem_file_types,
-                        root_dir,
-                        potential_failed_components,
-                        params_template_paths,
-                        params_target_paths,
-                        values_template_paths,
-                        values_target_paths,
-                        deployment_option,
-                    )
+            #multiple deployment_options, generate helm chart for each option
+            deployment_options = cfg[component]["deployment_options"].items()
         else:
-            version = cfg[component]["version"]
-            app_version = cfg[component]["app_version"]
-            kustomize_paths = cfg[component]["kustomization_paths"]
-            output_helm_chart_path = cfg[component]["output_helm_chart_path"]
-            #only one deployment_option, run generate helm chart
-            potential_failed_components = generate_helm_chart(
-                kustomize_paths,
-                helm_chart_name,
-                output_helm_chart_path,
-                version,
-                app_version,
-                kustomize_build_output_path,
-                helm_temp_output_path,
-                possible_problem_file_types,
-                root_dir,
-                potential_failed_components,
-                params_template_paths,
-                params_target_paths,
-                values_template_paths,
-                values_target_paths,
-                deployment_option,
+            #only one deployment_option
+            deployment_options = [(None, cfg[component])]
+
+        for deployment_option, chart_cfg in deployment_options:
+            output_helm_chart_path = chart_cfg["output_helm_chart_path"]
+            # each job only writes the values files inside its own chart, the
+            # other deployment options' charts may be generated concurrently
+            chart_values_template_paths = None
+            chart_values_target_paths = None
+            if values_template_paths:
+                chart_values = [
+                    (template_path, target_path)
+                    for template_path, target_path in zip(
+                        values_template_paths, values_target_paths
+                    )
+                    if target_path.startswith(f"{output_helm_chart_path}/")
+                ]
+                chart_values_template_paths = [paths[0] for paths in chart_values]
+                chart_values_target_paths = [paths[1] for paths in chart_values]
+            jobs.append(
+                {
+                    "kustomize_paths": chart_cfg["kustomization_paths"],
+                    "helm_chart_name": component,
+                    "output_helm_chart_path": output_helm_chart_path,
+                    "version": chart_cfg["version"],
+                    "app_version": chart_cfg["app_version"],
+                    "values_template_paths": chart_values_template_paths,
+                    "values_target_paths": chart_values_target_paths,
+                    "deployment_option": deployment_option,
+                    "helm_actions": helm_actions,
+                }
+            )
+    return jobs
+
+
+def run_helm_chart_job(job: dict):
+    """Runs generate_helm_chart for one job in a worker process.
+
+    Returns the files helm delimiters were escaped in, whether the chart was
+    unchanged, the chart's stats and the traceback of the error the job
+    raised, if any, so that one failure does not stop other jobs.
+    """
+    start = time.perf_counter()
+    try:
+        escaped_file_paths, cache_hit, stats = generate_helm_chart(**job)
+        stats["wall_seconds"] = time.perf_counter() - start
+        return escaped_file_paths, cache_hit, stats, None
+    except Exception:
+        return [], False, None, traceback.format_exc()
+
+
+def print_helm_chart_stats(chart_stats: list):
+    """Prints a table of the stats of every generated chart, slowest first."""
+    print_banner("Helm chart generation times")
+    phases = ["cache_check", "scaffold", "kustomize_build", "render", "write_chart"]
+    header = ["seconds"] + phases + ["objects", "written KiB", "chart"]
+    rows = []
+    for stats in sorted(chart_stats, key=lambda stats: -stats["wall_seconds"]):
+        rows.append(
+            [f"{stats['wall_seconds']:.2f}"]
+            + [f"{stats['phases'].get(phase, 0.0):.2f}" for phase in phases]
+            + [
+                str(stats["objects"]),
+                f"{stats['bytes_written'] / 1024:.1f}",
+                stats["chart"],
+            ]
+        )
+    widths = [max(len(row[i]) for row in [header] + rows) for i in range(len(header))]
+    for row in [header] + rows:
+        # numbers are right aligned, the chart path is left aligned
+        print(
+            "  ".join(cell.rjust(width) for cell, width in zip(row[:-1], widths))
+            + "  "
+            + row[-1]
+        )
+
+
+def main(jobs_count: int = 1, use_cache: bool = True, report_path: str = common.HELMIFY_REPORT_FILE):
+    timer = PhaseTimer()
+    run_start = time.perf_counter()
+    print_banner("Reading Config")
+    cfg = load_yaml_file(file_path=common.CONFIG_FILE)
+
+    start = time.perf_counter()
+
+    ##components need to configure env files before kustomize build. The
+    ##target files can be shared by the deployment options of a component,
+    ##so they are copied once before any job runs.
+    for component in Components:
+        if "params" in cfg[component]:
+            copy_template_files_to_target_files(
+                cfg[component]["params"]["template_paths"],
+                cfg[component]["params"]["target_paths"],
             )
-        
-    if len(potential_failed_components) != 0:
-        print_banner ("The following components have potential failed yaml files when running helm install")
-        print(potential_failed_components)
-        print (f"please check folder in {helm_temp_output_path}")
+    timer.add("params", start)
+
+    kustomize_version = None
+    if use_cache:
+        start = time.perf_counter()
+        kustomize_version = get_kustomize_version()
+        timer.add("kustomize_version", start)
+
+    jobs = helm_chart_jobs(cfg)
+    for job in jobs:
+        job["kustomize_version"] = kustomize_version
+
+    # every job writes to its own chart folder, so jobs only share
+    # the read-only kustomization trees and content addressed cache files
+    start = time.perf_counter()
+    if jobs_count > 1:
+        with ProcessPoolExecutor(max_workers=jobs_count) as executor:
+            results = list(executor.map(run_helm_chart_job, jobs))
+    else:
+        results = [run_helm_chart_job(job) for job in jobs]
+    timer.add("charts", start)
+
+    # results are merged in config order no matter which job finished first
+    escaped_file_paths = []
+    failed_jobs = []
+    cached_charts = []
+    chart_stats = []
+    for job, (job_escaped_file_paths, cache_hit, stats, error) in zip(jobs, results):
+        escaped_file_paths += job_escaped_file_paths
+        if stats:
+            chart_stats.append(stats)
+        if cache_hit:
+            cached_charts.append(job["output_helm_chart_path"])
+        if error:
+            failed_jobs.append((job, error))
+
+    report = {
+        "wall_seconds": time.perf_counter() - run_start,
+        "jobs": jobs_count,
+        "use_cache": use_cache,
+        "phases": timer.phases,
+        # kustomize runs in child processes, as do the jobs when jobs > 1.
+        # Processes are shared by charts, so peak RSS is only known per run.
+        "peak_rss_bytes": peak_rss_bytes(),
+        "children_peak_rss_bytes": peak_rss_bytes(resource.RUSAGE_CHILDREN),
+        "charts": chart_stats,
+    }
+    write_cache_file(report_path, json.dumps(report, indent=2) + "\n")
+    print_helm_chart_stats(chart_stats)
+    print(f"Report written to '{report_path}'")
+
+    if use_cache:
+        print_banner(f"{len(cached_charts)} of {len(jobs)} helm charts were unchanged")
+        for cached_chart in cached_charts:
+            print(cached_chart)
+
+    if escaped_file_paths:
+        print_banner("Escaped helm template delimiters in the following files")
+        for escaped_file_path in escaped_file_paths:
+            print(escaped_file_path)
+
+    if failed_jobs:
+        print_banner("The following helm charts failed to generate")
+        for job, error in failed_jobs:
+            print(f"{job['helm_chart_name']} {job['deployment_option'] or ''}")
+            print(error)
+        sys.exit(1)
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of helm charts to generate in parallel",
+        required=False,
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Regenerate every helm chart even if its kustomization inputs are unchanged",
+        required=False,
+    )
+    parser.add_argument(
+        "--report",
+        default=common.HELMIFY_REPORT_FILE,
+        help="Path of the JSON report of each chart's phase times, object counts and bytes written, and the run's peak RSS",
+        required=False,
+    )
+    args = parser.parse_args()
+
+    main(args.jobs, not args.no_cache, args.report)
@@ -0,0 +1,259 @@
+import argparse
+import hashlib
+import json
+import logging
+import subprocess
+import sys
+import tempfile
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import yaml
+from tests.e2e.utils.utils import (
+    print_banner,
+    load_yaml_file,
+)
+
+from tools.helmify.src import common
+from tools.helmify.src.kustomize_to_helm_automation import (
+    Components,
+    copy_template_files_to_target_files,
+    helm_chart_jobs,
+    kustomize_build_documents,
+)
+from tools.helmify.src.helm_escape import helm_delimiters
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def object_id(data: dict):
+    """Returns the apiVersion/kind/namespace/name an object is compared by."""
+    metadata = data.get("metadata") or {}
+    return "/".join(
+        [
+            data.get("apiVersion", ""),
+            data.get("kind", ""),
+            metadata.get("namespace") or "",
+            metadata.get("name", ""),
+        ]
+    )
+
+
+def canonical_object_hash(data: dict):
+    sha = hashlib.sha256()
+    sha.update(json.dumps(data, sort_keys=True, separators=(",", ":")).encode("utf-8"))
+    return sha.hexdigest()
+
+
+def helm_value(values: dict, path: str):
+    """Returns how helm prints .Values.<path>, or None if it is not a scalar."""
+    value = values
+    for key in path.split("."):
+        if not isinstance(value, dict):
+            return ""
+        value = value.get(key)
+    if value is None:
+        # helm prints missing values as empty strings
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (str, int, float)):
+        return str(value)
+    return None
+
+
+def render_values(text: str, values: dict, helm_actions=()):
+    """Renders the {{ .Values.<path> }} actions helmify leaves in an object.
+
+    Only helm_actions, the actions of the component's params templates, are
+    left unescaped by helmify. Other {{ and }} are rendered back as they are
+    by helm, so they are left unchanged, as are helm actions other than plain
+    value lookups, which then show up as differences.
+    """
+
+    def replace(match):
+        action = match.group(0)
+        if action in ("{{", "}}"):
+            return action
+        expression = action.strip("{}-").strip()
+        if expression.startswith(".Values.") and " " not in expression:
+            value = helm_value(values, expression[len(".Values."):])
+            if value is not None:
+                return value
+        return action
+
+    return helm_delimiters(tuple(helm_actions)).sub(replace, text)
+
+
+def kustomize_objects(kustomize_paths: list, values: dict, helm_actions=()):
+    """Returns the objects kustomize builds, as helm renders them from the chart."""
+    objects = {}
+    for kustomize_path in kustomize_paths:
+        for data in kustomize_build_documents(kustomize_path):
+            if data is None:
+                continue
+            data = yaml.safe_load(render_values(yaml.dump(data), values, helm_actions))
+            objects[object_id(data)] = data
+    return objects
+
+
+def helm_template_objects(rendered_file):
+    objects = {}
+    for data in yaml.safe_load_all(rendered_file):
+        if data is None:
+            continue
+        objects[object_id(data)] = data
+    return objects
+
+
+def differing_fields(expected, actual, path=""):
+    """Yields the paths of the fields that differ between two objects."""
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        for key in sorted(set(expected) | set(actual), key=str):
+            yield from differing_fields(
+                expected.get(key), actual.get(key), f"{path}.{key}"
+            )
+    elif isinstance(expected, list) and isinstance(actual, list) and len(
+        expected
+    ) == len(actual):
+        for i, (expected_item, actual_item) in enumerate(zip(expected, actual)):
+            yield from differing_fields(expected_item, actual_item, f"{path}[{i}]")
+    elif expected != actual:
+        yield path or "."
+
+
+def verify_helm_chart(
+    kustomize_paths: list, output_helm_chart_path: str, helm_actions=()
+):
+    """Compares the objects a chart renders to the ones kustomize builds.
+
+    helm template runs while the kustomize build is parsed. Returns the ids
+    of the objects only kustomize builds, the ones only the chart renders and
+    the differing fields of objects both have, by id.
+    """
+    values = load_yaml_file(file_path=f"{output_helm_chart_path}/values.yaml") or {}
+    with tempfile.TemporaryFile("w+") as rendered_file:
+        cmd = f"helm template helmify-verify {output_helm_chart_path} --include-crds"
+        process = subprocess.Popen(cmd, shell=True, stdout=rendered_file, text=True)
+        try:
+            expected = kustomize_objects(kustomize_paths, values, helm_actions)
+        finally:
+            if process.wait() != 0:
+                raise Exception(f"ERROR: Failed to execute shell command \n{cmd}")
+        rendered_file.seek(0)
+        actual = helm_template_objects(rendered_file)
+
+    expected_hashes = {key: canonical_object_hash(data) for key, data in expected.items()}
+    actual_hashes = {key: canonical_object_hash(data) for key, data in actual.items()}
+    missing = sorted(set(expected_hashes) - set(actual_hashes))
+    extra = sorted(set(actual_hashes) - set(expected_hashes))
+    differing = {
+        key: list(differing_fields(expected[key], actual[key]))
+        for key in sorted(set(expected_hashes) & set(actual_hashes))
+        if expected_hashes[key] != actual_hashes[key]
+    }
+    return {
+        "objects": len(expected_hashes),
+        "missing": missing,
+        "extra": extra,
+        "differing": differing,
+    }
+
+
+def run_verify_job(job: dict):
+    """Runs verify_helm_chart for one job in a worker process.
+
+    Returns the comparison and the traceback of the error the job raised, if
+    any, so that one failure does not stop other jobs.
+    """
+    try:
+        result = verify_helm_chart(
+            job["kustomize_paths"], job["output_helm_chart_path"], job["helm_actions"]
+        )
+        return result, None
+    except Exception:
+        return None, traceback.format_exc()
+
+
+def params_file_contents(cfg: dict):
+    """Returns the content of every params target file, by path."""
+    contents = {}
+    for component in Components:
+        if "params" in cfg[component]:
+            for target_path in cfg[component]["params"]["target_paths"]:
+                with open(target_path, "r") as file:
+                    contents[target_path] = file.read()
+    return contents
+
+
+def main(jobs_count: int = 1):
+    print_banner("Reading Config")
+    cfg = load_yaml_file(file_path=common.CONFIG_FILE)
+    jobs = helm_chart_jobs(cfg)
+
+    ##kustomize builds with the same params templates helmify generated the
+    ##charts from, the original params files are restored afterwards
+    original_params = params_file_contents(cfg)
+    try:
+        for component in Components:
+            if "params" in cfg[component]:
+                copy_template_files_to_target_files(
+                    cfg[component]["params"]["template_paths"],
+                    cfg[component]["params"]["target_paths"],
+                )
+
+        if jobs_count > 1:
+            with ProcessPoolExecutor(max_workers=jobs_count) as executor:
+                results = list(executor.map(run_verify_job, jobs))
+        else:
+            results = [run_verify_job(job) for job in jobs]
+    finally:
+        for target_path, content in original_params.items():
+            with open(target_path, "w") as file:
+                file.write(content)
+
+    # results are reported in config order no matter which job finished first
+    failed = False
+    print_banner("Comparing helm charts to kustomize builds")
+    for job, (result, error) in zip(jobs, results):
+        chart = job["output_helm_chart_path"]
+        if error:
+            failed = True
+            print(f"{chart}: failed to verify")
+            print(error)
+            continue
+        if not (result["missing"] or result["extra"] or result["differing"]):
+            print(f"{chart}: {result['objects']} objects match")
+            continue
+        failed = True
+        print(
+            f"{chart}: {len(result['missing'])} missing, {len(result['extra'])} extra, "
+            f"{len(result['differing'])} differing of {result['objects']} objects"
+        )
+        for key in result["missing"]:
+            print(f"  missing {key}")
+        for key in result["extra"]:
+            print(f"  extra {key}")
+        for key, fields in result["differing"].items():
+            print(f"  differing {key}: {', '.join(fields)}")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Verify that the helm charts helmify generated render the objects kustomize builds."
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of helm charts to verify in parallel",
+        required=False,
+    )
+    args = parser.parse_args()
+
+    main(args.jobs)